@@ -1,19 +1,24 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import geojson
-from shapely.geometry import shape, mapping
 import folium
-from streamlit_folium import folium_static
-import plotly.express as px
+from streamlit_folium import folium_static, st_folium
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 import tempfile
+import hashlib
 import shutil
 from folium.plugins import Draw, MeasureControl, Fullscreen, MousePosition
-import json
+from utils.spatial_index import SpatialIndex, as_geometry
+from utils.instrumentation import recorder, stage
+from utils.forecasting import forecast_reaches
+from utils.ingestion import SHAPEFILE_PARTS, stage_uploads, load_region
+from utils.terrain import TerrainMeshCache, load_dem
+from utils.export import VECTOR_FORMATS, export_features, iter_records
+from utils.visualization import plot_terrain_mesh, plot_morphological_metrics, plot_erosion_deposition
+from utils.reports import FigureCache, build_report
 
 # Load environment variables
 load_dotenv()
@@ -32,6 +37,85 @@ def load_data():
     # Add your data loading logic here
     return None
 
+@st.cache_resource
+def get_spatial_index():
+    # Shared across sessions so overlapping requests can reuse earlier work
+    return SpatialIndex()
+
+def region_key(region):
+    # Stable id of an AOI, so reruns over the same area replace their entries
+    return hashlib.blake2b(region.wkb, digest_size=12).hexdigest()
+
+def describe_overlaps(region):
+    overlaps = get_spatial_index().query(region)
+    return (
+        f"{len(overlaps['reaches'])} known reaches, "
+        f"{len(overlaps['results'])} stored results in this area."
+    )
+
+@st.cache_resource
+def get_terrain_cache():
+    # Decimated meshes per DEM and zoom level, shared across sessions
+    return TerrainMeshCache()
+
+@st.cache_resource
+def get_figure_cache():
+    # Rendered report figures keyed by content hash
+    return FigureCache()
+
+@st.cache_data(max_entries=4)
+def read_region(uploads):
+    # Keyed by the uploaded (name, bytes) pairs, so reruns do not dissolve the network again
+    temp_dir = tempfile.mkdtemp()
+    try:
+        datasets = stage_uploads(uploads, temp_dir)
+        if not datasets:
+            return None, None, False
+        with stage("load_region", "ingestion"):
+            region, approximate = load_region(datasets[0])
+        return os.path.basename(datasets[0]), region, approximate
+    finally:
+        shutil.rmtree(temp_dir)
+
+@st.cache_data(max_entries=4)
+def read_dem(name, data):
+    suffix = os.path.splitext(name)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        f.write(data)
+    try:
+        # The upload name carries the SRTM tile's location
+        return load_dem(f.name, name=name)
+    finally:
+        os.remove(f.name)
+
+# Metric cards shown in Analysis Results and in generated reports
+METRIC_CARDS = {
+    "Channel Statistics": [
+        ("Average Width Change", "2.5 m", "+0.3 m"),
+        ("Migration Rate", "15 m/year", "-2 m/year"),
+        ("Channel Length", "45.2 km", "+1.2 km"),
+        ("Channel Slope", "0.002", "-0.0001"),
+    ],
+    "Erosion Analysis": [
+        ("Erosion Area", "2.3 km²", "+0.5 km²"),
+        ("Deposition Area", "1.8 km²", "-0.2 km²"),
+        ("Erosion Rate", "1.2 m/year", "+0.1 m/year"),
+        ("Sediment Yield", "1500 t/km²/year", "+200 t/km²/year"),
+    ],
+    "Water Quality": [
+        ("Turbidity", "15 NTU", "-2 NTU"),
+        ("Sediment Load", "1200 t/day", "+150 t/day"),
+        ("Dissolved Oxygen", "8.2 mg/L", "+0.3 mg/L"),
+        ("pH Level", "7.4", "-0.1"),
+    ],
+    "Environmental Impact": [
+        ("Vegetation Loss", "0.8 km²", "+0.2 km²"),
+        ("Habitat Change", "1.5 km²", "-0.3 km²"),
+        ("Biodiversity Index", "0.75", "-0.05"),
+        ("Carbon Storage", "1200 tC", "-50 tC"),
+    ],
+}
+
 # ASU Theme Colors
 ASU_COLORS = {
     'maroon': '#8C1D40',
@@ -380,19 +464,30 @@ with st.sidebar:
     )
     
     if data_source == "Upload Shapefile":
-        uploaded_file = st.file_uploader("Upload River Shapefile", type=['shp', 'dbf', 'shx', 'prj'])
-        if uploaded_file:
-            temp_dir = tempfile.mkdtemp()
-            file_path = os.path.join(temp_dir, uploaded_file.name)
-            with open(file_path, 'wb') as f:
-                f.write(uploaded_file.getbuffer())
+        uploaded_files = st.file_uploader(
+            "Upload River Shapefile (all parts), zipped Shapefile or GeoPackage",
+            type=[ext.lstrip('.') for ext in SHAPEFILE_PARTS] + ['zip', 'gpkg'],
+            accept_multiple_files=True
+        )
+        if uploaded_files:
             try:
-                gdf = gpd.read_file(file_path)
-                st.success("Shapefile uploaded successfully!")
+                name, region, approximate = read_region(
+                    tuple((uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files)
+                )
+                if region is None:
+                    st.warning("No Shapefile or GeoPackage found in the upload.")
+                else:
+                    st.session_state['region'] = region
+                    if approximate:
+                        st.warning(
+                            f"{name} is too detailed to simplify within the Earth Engine vertex limit; "
+                            f"its convex hull or bounding box is used instead: {describe_overlaps(region)}"
+                        )
+                    else:
+                        st.success(f"Loaded {name}: {describe_overlaps(region)}")
+                    get_spatial_index().add_reach(region_key(region), region, name=name)
             except Exception as e:
                 st.error(f"Error reading shapefile: {str(e)}")
-            finally:
-                shutil.rmtree(temp_dir)
     
     # Date range selection with enhanced options
     st.subheader("Time Period")
@@ -444,14 +539,52 @@ with st.sidebar:
     with col2:
         show_annotations = st.checkbox("Show Annotations", value=True)
         show_3d = st.checkbox("Show 3D View", value=False)
+    show_debug = st.checkbox("Show Performance Debug Panel", value=False)
     
     # Export Options
     st.subheader("Export Options")
     export_format = st.selectbox(
         "Select export format",
-        ["GeoJSON", "Shapefile", "CSV", "PDF Report"],
+        ["GeoJSON", "Shapefile", "GeoPackage", "CSV", "Parquet", "PDF Report"],
         key="export_format"
     )
+    if export_format == "PDF Report":
+        st.caption("PDF reports are generated in the Reports tab.")
+    else:
+        # Layers produced so far in this session, each streamed as features
+        export_layers = {}
+        if 'region' in st.session_state:
+            export_layers["Study Region"] = (
+                lambda: iter([{'geometry': st.session_state['region'], 'properties': {'name': 'region'}}]),
+                'EPSG:4326'
+            )
+        if 'time_series' in st.session_state and export_format not in VECTOR_FORMATS:
+            # Plain rows without geometry; dates as ISO strings for every format
+            metrics_table = st.session_state['time_series'].rename_axis('date').reset_index()
+            metrics_table['date'] = metrics_table['date'].dt.strftime('%Y-%m-%d')
+            export_layers["Metrics Table"] = (lambda: iter_records(metrics_table), None)
+
+        if not export_layers:
+            st.caption("Run an analysis or upload a region to enable exports.")
+        else:
+            export_layer = st.selectbox("Layer to export", list(export_layers), key="export_layer")
+            if st.button("Prepare Export"):
+                features, layer_crs = export_layers[export_layer]
+                export_dir = tempfile.mkdtemp()
+                try:
+                    name = export_layer.lower().replace(' ', '_')
+                    path, mime = export_features(features(), export_format, export_dir, name, crs=layer_crs)
+                    with open(path, 'rb') as f:
+                        st.download_button(
+                            f"Download {os.path.basename(path)}",
+                            f,
+                            file_name=os.path.basename(path),
+                            mime=mime
+                        )
+                except Exception as e:
+                    st.error(f"Export failed: {str(e)}")
+                finally:
+                    shutil.rmtree(export_dir)
     
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -530,7 +663,18 @@ with tab1:
     ).add_to(m)
     
     st.markdown('<div class="map-container">', unsafe_allow_html=True)
-    folium_static(m)
+    if data_source == "Draw on Map":
+        # st_folium sends drawn shapes back, at the cost of a rerun per edit
+        with stage("st_folium", "render"):
+            output = st_folium(m, returned_objects=["last_active_drawing"])
+        drawing = (output or {}).get("last_active_drawing")
+        if drawing:
+            region = as_geometry(drawing)
+            st.session_state['region'] = region
+            st.caption(f"Drawn area: {describe_overlaps(region)}")
+    else:
+        with stage("folium_static", "render"):
+            folium_static(m)
     st.markdown('</div>', unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -562,6 +706,33 @@ with tab2:
                 marker=dict(size=8)
             ))
         
+        # Forecast every metric in one vectorized fit
+        if "Future Prediction" in analysis_type:
+            step = dates[1] - dates[0]
+            if step <= pd.Timedelta(0):
+                st.info("Pick an end date after the start date to forecast.")
+            else:
+                future_dates = pd.date_range(start=dates[-1] + step, periods=5, freq=step)
+                forecast = forecast_reaches(data.to_numpy().T, dates.values, future_dates.values)
+                for i, column in enumerate(data.columns):
+                    fig.add_trace(go.Scatter(
+                        x=list(future_dates) + list(future_dates[::-1]),
+                        y=list(forecast['upper'][i]) + list(forecast['lower'][i][::-1]),
+                        fill='toself',
+                        fillcolor='rgba(140, 29, 64, 0.1)',
+                        line=dict(width=0),
+                        name=f"{column} (95% interval)",
+                        showlegend=False,
+                        hoverinfo='skip'
+                    ))
+                    fig.add_trace(go.Scatter(
+                        x=future_dates,
+                        y=forecast['mean'][i],
+                        name=f"{column} (forecast)",
+                        line=dict(width=2, dash='dash'),
+                        mode='lines'
+                    ))
+        
         fig.update_layout(
             title="River Morphology Metrics Over Time",
             xaxis_title="Date",
@@ -580,6 +751,8 @@ with tab2:
             )
         )
         st.plotly_chart(fig, use_container_width=True)
+        st.session_state['time_series'] = data
+        st.session_state['time_series_figure'] = fig
     st.markdown('</div>', unsafe_allow_html=True)
 
 with tab3:
@@ -588,46 +761,28 @@ with tab3:
     if not analysis_type:
         st.info("Please select analysis type(s) from the sidebar to view results.")
     else:
-        # Enhanced metric cards with more information
-        col1, col2 = st.columns(2)
+        # Enhanced metric cards with more information, two per row
+        cards = list(METRIC_CARDS.items())
+        for row in (cards[:2], cards[2:]):
+            for column, (title, metrics) in zip(st.columns(2), row):
+                with column:
+                    st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+                    st.subheader(title)
+                    for label, value, delta in metrics:
+                        st.metric(label, value, delta)
+                    st.markdown('</div>', unsafe_allow_html=True)
         
-        with col1:
-            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-            st.subheader("Channel Statistics")
-            st.metric("Average Width Change", "2.5 m", "+0.3 m")
-            st.metric("Migration Rate", "15 m/year", "-2 m/year")
-            st.metric("Channel Length", "45.2 km", "+1.2 km")
-            st.metric("Channel Slope", "0.002", "-0.0001")
-            st.markdown('</div>', unsafe_allow_html=True)
-        
-        with col2:
-            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-            st.subheader("Erosion Analysis")
-            st.metric("Erosion Area", "2.3 km²", "+0.5 km²")
-            st.metric("Deposition Area", "1.8 km²", "-0.2 km²")
-            st.metric("Erosion Rate", "1.2 m/year", "+0.1 m/year")
-            st.metric("Sediment Yield", "1500 t/km²/year", "+200 t/km²/year")
-            st.markdown('</div>', unsafe_allow_html=True)
-        
-        # Additional metrics with enhanced visualization
-        col3, col4 = st.columns(2)
-        with col3:
-            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-            st.subheader("Water Quality")
-            st.metric("Turbidity", "15 NTU", "-2 NTU")
-            st.metric("Sediment Load", "1200 t/day", "+150 t/day")
-            st.metric("Dissolved Oxygen", "8.2 mg/L", "+0.3 mg/L")
-            st.metric("pH Level", "7.4", "-0.1")
-            st.markdown('</div>', unsafe_allow_html=True)
-        
-        with col4:
-            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-            st.subheader("Environmental Impact")
-            st.metric("Vegetation Loss", "0.8 km²", "+0.2 km²")
-            st.metric("Habitat Change", "1.5 km²", "-0.3 km²")
-            st.metric("Biodiversity Index", "0.75", "-0.05")
-            st.metric("Carbon Storage", "1200 tC", "-50 tC")
-            st.markdown('</div>', unsafe_allow_html=True)
+        # Register the analyzed extent so later AOIs overlapping it find this run
+        if 'region' in st.session_state:
+            region = st.session_state['region']
+            get_spatial_index().add_result(
+                f"{region_key(region)}:{start_date}:{end_date}:{resolution}",
+                region,
+                analyses=list(analysis_type),
+                start_date=str(start_date),
+                end_date=str(end_date),
+                resolution=resolution
+            )
         
         # Enhanced visualizations
         st.subheader("Advanced Visualizations")
@@ -677,15 +832,131 @@ with tab3:
 with tab4:
     st.markdown('<div class="tab-content">', unsafe_allow_html=True)
     st.header("3D View")
-    st.info("3D visualization coming soon!")
+    if not show_3d:
+        st.info("Enable 'Show 3D View' in the sidebar to render the terrain.")
+    else:
+        dem_file = st.file_uploader(
+            "Upload DEM tile (SRTM .hgt, GeoTIFF or .npy)",
+            type=['hgt', 'tif', 'tiff', 'npy'],
+            key="dem_file"
+        )
+        if dem_file is None:
+            st.info("Upload a DEM tile to build the 3D terrain.")
+        else:
+            try:
+                dem, pixel_size, latitude = read_dem(dem_file.name, dem_file.getvalue())
+                col1, col2 = st.columns(2)
+                with col1:
+                    zoom = st.slider("Detail (zoom level)", 8, 16, 12)
+                with col2:
+                    exaggeration = st.slider("Vertical Exaggeration", 1.0, 10.0, 2.0, 0.5)
+
+                with stage("terrain_mesh", "render"):
+                    mesh = get_terrain_cache().get(
+                        dem,
+                        zoom,
+                        latitude=latitude,
+                        pixel_size=pixel_size,
+                        vertical_exaggeration=exaggeration
+                    )
+
+                fig = plot_terrain_mesh(
+                    mesh,
+                    vertical_exaggeration=exaggeration,
+                    title=dem_file.name
+                )
+                fig.update_layout(height=700)
+                st.plotly_chart(fig, use_container_width=True)
+                st.caption(
+                    f"{len(mesh['i']):,} triangles from {dem.size:,} DEM samples "
+                    f"(max vertical error {mesh['tolerance']:.1f} m)"
+                )
+            except Exception as e:
+                st.error(f"Error building terrain: {str(e)}")
     st.markdown('</div>', unsafe_allow_html=True)
 
 with tab5:
     st.markdown('<div class="tab-content">', unsafe_allow_html=True)
     st.header("Reports")
-    st.info("Report generation coming soon!")
+    col1, col2 = st.columns(2)
+    with col1:
+        report_format = st.radio(
+            "Report format",
+            ["PDF", "HTML"],
+            index=0 if export_format == "PDF Report" else 1,
+            horizontal=True
+        )
+    with col2:
+        interactive = st.checkbox(
+            "Interactive figures (HTML only)",
+            value=False,
+            disabled=report_format != "HTML"
+        )
+
+    # Figures are rendered statically and cached by content, so only
+    # figures affected by a parameter change are rendered again
+    report = {
+        'title': "River Morphology Report",
+        'subtitle': f"{start_date:%Y-%m-%d} to {end_date:%Y-%m-%d} · {resolution} m resolution",
+        'metrics': METRIC_CARDS,
+        'figures': [],
+        'maps': [("Study area", m)],
+    }
+    if 'time_series_figure' in st.session_state:
+        report['figures'].append(("Morphology metrics over time", st.session_state['time_series_figure']))
+    if 'time_series' in st.session_state:
+        report['figures'].append((
+            "Metric distributions",
+            plot_morphological_metrics(st.session_state['time_series'].to_dict('list'))
+        ))
+    report['figures'].append(("Erosion vs deposition", plot_erosion_deposition(2.3, 1.8)))
+
+    if st.button("Generate Report"):
+        try:
+            with st.spinner("Rendering report..."):
+                data = build_report(
+                    report,
+                    fmt=report_format.lower(),
+                    interactive=interactive,
+                    cache=get_figure_cache()
+                )
+            extension = 'pdf' if report_format == "PDF" else 'html'
+            st.download_button(
+                f"Download {report_format} Report",
+                data,
+                file_name=f"river_morphology_report.{extension}",
+                mime='application/pdf' if report_format == "PDF" else 'text/html'
+            )
+            cache = get_figure_cache()
+            st.caption(f"Figure cache: {cache.hits} hits, {cache.misses} misses")
+        except Exception as e:
+            st.error(f"Error generating report: {str(e)}")
     st.markdown('</div>', unsafe_allow_html=True)
 
+# Performance debug panel
+if show_debug:
+    with st.expander("Performance Debug", expanded=True):
+        # Events are recorded process-wide; clearing only hides earlier ones from this session
+        since = st.session_state.get('events_since')
+        st.caption("Calls from every session served by this process. CPU time is process-wide.")
+        summary = recorder.summary(since)
+        if summary:
+            st.dataframe(pd.DataFrame(summary), use_container_width=True)
+        else:
+            st.info("No instrumented calls recorded yet.")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                "Download Chrome Trace",
+                recorder.to_chrome_trace(since),
+                file_name="river_morphology_trace.json",
+                mime="application/json"
+            )
+        with col2:
+            if st.button("Clear Events (this session)"):
+                st.session_state['events_since'] = recorder.now()
+                st.rerun()
+
 # Enhanced Footer
 st.markdown("""
     <div class="footer">
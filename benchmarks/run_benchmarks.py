@@ -0,0 +1,297 @@
+"""
+End-to-end benchmarks for the river morphology pipeline
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --sizes 1000 4000 10000
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/baseline.json
+"""
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.synthetic import elevation_model, make_scene
+from utils.instrumentation import RSSSampler, current_rss, recorder
+from utils.lazy import preload
+
+DEFAULT_SIZES = (1000, 4000, 10000)
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# Number of 256x256 tiles pushed through the U-Net per scene. Inference time
+# scales linearly with tiles, so a fixed count keeps runs comparable.
+INFERENCE_TILES = 16
+
+# Peak memory budget per stage in bytes per scene pixel, on top of the scene
+# itself, following the dtype policy in utils.processing (bool masks, int32
+# labels, float16 probabilities). Each budget is the measured peak at 4000^2
+# plus ~10% headroom, below what the uint8/float32 copies of the original
+# pipeline needed; build_mesh is set from its largest RSS growth over repeated
+# runs, which varies by a third with allocator state. MEMORY_SLACK_MB covers interpreter and allocator noise;
+# it must stay small against size^2 * budget, so budgets are only meaningful
+# from about 4000^2 up. Checked with --check-memory and by
+# tests/test_memory_budgets.py.
+MEMORY_BUDGETS = {
+    'postprocess_mask': 6.5,
+    'remove_small_objects': 5.5,
+    'calculate_morphological_metrics': 9.5,
+    'calculate_centerline_metrics': 4,
+    'detect_meander_shifts': 9,
+    'calculate_migration': 4,
+    'calculate_erosion_deposition': 1.5,
+    'build_mesh': 24,
+}
+MEMORY_SLACK_MB = 8
+
+
+def measure(fn, *args, trace=True, **kwargs):
+    """
+    Run fn and return (result, stats) with wall time, CPU time and memory peaks
+
+    tracemalloc hooks every allocation and would slow the timed call, so
+    times and RSS come from an untraced run and, with trace=True, the traced
+    peak from a second run whose result is discarded.
+    """
+    gc.collect()
+    baseline_rss = current_rss()
+    with RSSSampler() as sampler:
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        result = fn(*args, **kwargs)
+        cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+
+    traced_peak = 0
+    if trace:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            fn(*args, **kwargs)
+            _, traced_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    stats = {
+        'wall_s': wall,
+        'cpu_s': cpu,
+        'peak_traced_mb': traced_peak / 2**20,
+        'peak_rss_mb': sampler.peak / 2**20,
+        'rss_delta_mb': (sampler.peak - baseline_rss) / 2**20,
+    }
+    return result, stats
+
+
+def _tile_batch(image, count, tile=256):
+    """
+    Cut up to count tiles from the top-left of an image, row by row
+    """
+    tiles = []
+    height, width = image.shape[:2]
+    for row in range(0, height - tile + 1, tile):
+        for col in range(0, width - tile + 1, tile):
+            tiles.append(image[row:row + tile, col:col + tile])
+            if len(tiles) == count:
+                return np.stack(tiles)
+    return np.stack(tiles)
+
+
+def build_stages(scene, skip):
+    """
+    Return (name, callable) pairs for every hot path, in pipeline order
+    """
+    from utils import centerline, migration, processing
+
+    stages = [
+        ('preprocess_image', lambda: processing.preprocess_image(scene['image'])),
+    ]
+
+    if 'inference' not in skip:
+        # models.unet imports TensorFlow lazily, so check for it up front
+        if importlib.util.find_spec('tensorflow') is None:
+            print("TensorFlow not available, skipping U-Net inference", file=sys.stderr)
+        else:
+            from models.unet import predict, unet_model
+            model = unet_model()
+            tiles = _tile_batch(scene['image'], INFERENCE_TILES).astype(np.float32) / 255.0
+            stages.append(('unet_inference', lambda: predict(model, tiles, batch_size=8)))
+            stages.append(('unet_inference_tta', lambda: predict(model, tiles, batch_size=8, tta='all')))
+
+    stages += [
+        ('postprocess_mask', lambda: processing.postprocess_mask(scene['probs'])),
+        ('remove_small_objects', lambda: processing.remove_small_objects(scene['mask1'])),
+        ('calculate_morphological_metrics', lambda: processing.calculate_morphological_metrics(scene['mask1'])),
+        ('calculate_centerline_metrics', lambda: centerline.calculate_centerline_metrics(scene['mask1'])),
+        ('detect_meander_shifts', lambda: processing.detect_meander_shifts(scene['mask1'], scene['mask2'])),
+        ('calculate_migration', lambda: migration.calculate_migration(
+            scene['mask1'], scene['mask2'], '2020-01-01', '2021-01-01')),
+        ('calculate_erosion_deposition', lambda: processing.calculate_erosion_deposition(scene['mask1'], scene['mask2'])),
+    ]
+
+    if 'render' not in skip:
+        from utils import visualization
+        stages.append((
+            'add_river_layer',
+            lambda: visualization.add_river_layer(visualization.create_folium_map(), scene['mask1'])
+        ))
+
+        from utils import terrain
+        dem = elevation_model(scene['mask1'])
+        stages.append(('build_mesh', lambda: terrain.build_mesh(dem, tolerance=terrain.zoom_tolerance(12))))
+
+    return [(name, fn) for name, fn in stages if name not in skip]
+
+
+def run(sizes, repeats=1, skip=(), seed=0):
+    """
+    Benchmark every stage at every scene size and return a list of records
+    """
+    # Per-call events would only add overhead to the measurements here
+    recorder.enabled = False
+    # Heavy dependencies are imported lazily; load them now so their import
+    # time is not charged to the first stage that uses them
+    from utils import centerline, migration, processing, terrain, visualization
+    preload(centerline, migration, processing, terrain, visualization)
+    records = []
+    for size in sizes:
+        print(f"Generating {size}x{size} scene", file=sys.stderr)
+        scene, scene_stats = measure(make_scene, size, seed=seed, trace=False)
+        records.append({'size': size, 'stage': 'make_scene', 'repeat': 0, **scene_stats})
+
+        for name, fn in build_stages(scene, skip):
+            for repeat in range(repeats):
+                _, stats = measure(fn)
+                records.append({'size': size, 'stage': name, 'repeat': repeat, **stats})
+                print(f"  {name:<34} {stats['wall_s']:8.3f}s  {stats['peak_rss_mb']:8.1f} MB",
+                      file=sys.stderr)
+        del scene
+    return records
+
+
+def environment():
+    """
+    Describe the machine and code version a run was made on
+    """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def summarize(records):
+    """
+    Collapse repeats to the best (minimum) wall time per (size, stage)
+    """
+    summary = {}
+    for record in records:
+        key = (record['size'], record['stage'])
+        best = summary.get(key)
+        if best is None or record['wall_s'] < best['wall_s']:
+            summary[key] = record
+    return summary
+
+
+def compare(current, baseline_path, tolerance=0.10):
+    """
+    Print per-stage ratios against a baseline run; returns True if any stage regressed
+    """
+    with open(baseline_path) as f:
+        baseline = summarize(json.load(f)['results'])
+    current = summarize(current)
+
+    regressed = False
+    print(f"{'size':>6} {'stage':<34} {'wall':>8} {'base':>8} {'ratio':>7} {'rss ratio':>9}")
+    for key in sorted(current):
+        if key not in baseline:
+            continue
+        now, base = current[key], baseline[key]
+        ratio = now['wall_s'] / base['wall_s'] if base['wall_s'] else float('nan')
+        rss_ratio = now['peak_rss_mb'] / base['peak_rss_mb'] if base['peak_rss_mb'] else float('nan')
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  SLOWER'
+            regressed = True
+        print(f"{key[0]:>6} {key[1]:<34} {now['wall_s']:8.3f} {base['wall_s']:8.3f} "
+              f"{ratio:7.2f} {rss_ratio:9.2f}{flag}")
+    return regressed
+
+
+def check_memory(records, budgets=MEMORY_BUDGETS, slack_mb=MEMORY_SLACK_MB):
+    """
+    Print each budgeted stage's peak memory against its budget; returns the
+    list of (size, stage, peak_mb, budget_mb) over budget
+
+    The peak is the larger of the traced (NumPy) peak and the RSS growth,
+    since OpenCV and SciPy allocate outside tracemalloc's view.
+    """
+    over = []
+    print(f"{'size':>6} {'stage':<34} {'peak MB':>8} {'budget':>8}")
+    for (size, stage_name), record in sorted(summarize(records).items()):
+        if stage_name not in budgets:
+            continue
+        peak = max(record['peak_traced_mb'], record['rss_delta_mb'])
+        budget = budgets[stage_name] * size * size / 2**20 + slack_mb
+        flag = ''
+        if peak > budget:
+            flag = '  OVER'
+            over.append((size, stage_name, peak, budget))
+        print(f"{size:>6} {stage_name:<34} {peak:8.1f} {budget:8.1f}{flag}")
+    return over
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='Scene edge lengths in pixels')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip', nargs='*', default=[],
+                        help="Stage names to skip; 'inference' and 'render' skip optional stages")
+    parser.add_argument('--output', help='Result JSON path (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', help='Baseline result JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Allowed slowdown before a stage is flagged')
+    parser.add_argument('--check-memory', action='store_true',
+                        help='Fail if a stage exceeds its peak memory budget')
+    args = parser.parse_args(argv)
+
+    records = run(args.sizes, repeats=args.repeats, skip=set(args.skip), seed=args.seed)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f'{stamp}.json')
+    with open(output, 'w') as f:
+        json.dump({'environment': environment(), 'results': records}, f, indent=2)
+    print(f"Wrote {output}", file=sys.stderr)
+
+    failed = False
+    if args.compare:
+        failed |= compare(records, args.compare, args.tolerance)
+    if args.check_memory:
+        failed |= bool(check_memory(records))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
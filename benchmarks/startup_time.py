@@ -0,0 +1,130 @@
+"""
+Cold-start import report for the app and pipeline modules
+
+Each target is imported in a fresh interpreter with `-X importtime`. The
+report lists total import time, the slowest top-level dependencies and any
+heavy dependency that was loaded eagerly.
+
+    python -m benchmarks.startup_time
+    python -m benchmarks.startup_time --max-seconds 3 --output startup.json
+"""
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported when the feature using them runs
+HEAVY_MODULES = ('tensorflow', 'ee', 'skimage', 'scipy', 'cv2', 'fiona', 'rtree', 'plotly')
+
+MODULE_TARGETS = (
+    'utils.processing',
+    'utils.visualization',
+    'utils.gee_utils',
+    'utils.ingestion',
+    'utils.spatial_index',
+    'models.unet',
+)
+
+# Streamlit loads some heavy modules itself (1.32 imports plotly.graph_objects),
+# so those count against the app target only if streamlit does not
+APP_FRAMEWORK = 'import streamlit'
+
+
+def app_import_code(path=os.path.join(REPO_ROOT, 'app.py')):
+    """
+    Source of the module-level import statements in app.py
+
+    Importing app.py itself would run the Streamlit script, so only its
+    imports are replayed.
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    imports = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return '\n'.join(ast.unparse(node) for node in imports)
+
+
+def profile_imports(code):
+    """
+    Run import code in a fresh interpreter and return timing and loaded heavy modules
+    """
+    probe = (
+        f"{code}\n"
+        "import json, sys\n"
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))\n"
+    )
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', probe],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        return {'error': proc.stderr.strip().splitlines()[-1:], 'wall_s': wall}
+
+    top_level = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented under their parent
+        if not name.startswith('  ') and name.strip():
+            top_level.append((name.strip(), int(cumulative) / 1e6))
+    top_level.sort(key=lambda item: item[1], reverse=True)
+
+    return {
+        'wall_s': wall,
+        'import_s': sum(seconds for _, seconds in top_level),
+        'slowest': top_level[:10],
+        'heavy_loaded': json.loads(proc.stdout.strip().splitlines()[-1]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--max-seconds', type=float,
+                        help='Fail if replaying the app imports takes longer than this')
+    parser.add_argument('--output', help='Write the report as JSON')
+    args = parser.parse_args(argv)
+
+    report = {'app': profile_imports(app_import_code())}
+    framework = profile_imports(APP_FRAMEWORK)
+    if 'heavy_loaded' in report['app'] and 'heavy_loaded' in framework:
+        report['app']['framework_heavy'] = framework['heavy_loaded']
+        report['app']['heavy_loaded'] = [
+            m for m in report['app']['heavy_loaded'] if m not in framework['heavy_loaded']
+        ]
+    for module in MODULE_TARGETS:
+        report[module] = profile_imports(f"import {module}")
+
+    failed = False
+    for target, result in report.items():
+        if 'error' in result:
+            print(f"{target:<22} import failed: {' '.join(result['error'])}")
+            failed = True
+            continue
+        heavy = ', '.join(result['heavy_loaded']) or '-'
+        print(f"{target:<22} {result['import_s']:6.2f}s imports  {result['wall_s']:6.2f}s wall  eager heavy: {heavy}")
+        for name, seconds in result['slowest'][:5]:
+            print(f"    {seconds:6.3f}s  {name}")
+        if result['heavy_loaded']:
+            failed = True
+
+    app = report['app']
+    if args.max_seconds is not None and 'import_s' in app and app['import_s'] > args.max_seconds:
+        print(f"App imports took {app['import_s']:.2f}s, budget is {args.max_seconds:.2f}s")
+        failed = True
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
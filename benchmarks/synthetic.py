@@ -0,0 +1,114 @@
+import numpy as np
+
+# Rows generated per block. Keeps temporaries small for 10k x 10k scenes.
+BLOCK_ROWS = 1024
+
+
+def meander_centerline(width, height, wavelength=None, amplitude=None, phase=0.0, seed=0):
+    """
+    Row coordinate of a meandering channel centerline for every column
+
+    The centerline is a sum of a dominant sine and a weaker harmonic with a
+    slowly drifting wavelength, which gives asymmetric bends similar to a
+    real meander train.
+    """
+    rng = np.random.default_rng(seed)
+    wavelength = wavelength or width / 4.0
+    amplitude = amplitude or height / 6.0
+
+    x = np.arange(width, dtype=np.float64)
+    drift = 1.0 + 0.15 * np.sin(2 * np.pi * x / (width * 1.3) + rng.uniform(0, 2 * np.pi))
+    theta = 2 * np.pi * x / (wavelength * drift) + phase
+    centerline = height / 2.0 + amplitude * (np.sin(theta) + 0.25 * np.sin(3 * theta + 0.5))
+    return centerline
+
+
+def channel_mask(size, channel_width=None, phase=0.0, seed=0):
+    """
+    Binary (bool) mask of a meandering channel on a size x size grid
+    """
+    channel_width = channel_width or max(size // 60, 4)
+    centerline = meander_centerline(size, size, phase=phase, seed=seed)
+    lower = np.floor(centerline - channel_width / 2.0).astype(np.int32)
+    upper = np.ceil(centerline + channel_width / 2.0).astype(np.int32)
+
+    mask = np.empty((size, size), dtype=bool)
+    for start in range(0, size, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, size)
+        rows = np.arange(start, stop, dtype=np.int32)[:, None]
+        np.logical_and(rows >= lower, rows < upper, out=mask[start:stop])
+    return mask
+
+
+def multispectral_scene(mask, bands=3, seed=0):
+    """
+    Synthetic uint8 scene (H, W, bands) in which water pixels are darker in
+    every band, with per-pixel noise
+    """
+    rng = np.random.default_rng(seed)
+    height, width = mask.shape
+    land = np.array([110, 130, 150, 170][:bands], dtype=np.int16)
+    water = np.array([60, 70, 40, 20][:bands], dtype=np.int16)
+
+    scene = np.empty((height, width, bands), dtype=np.uint8)
+    for start in range(0, height, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, height)
+        block = mask[start:stop, :, None].astype(bool)
+        noise = rng.integers(-20, 21, size=(stop - start, width, bands), dtype=np.int16)
+        values = np.where(block, water, land) + noise
+        np.clip(values, 0, 255, out=values)
+        scene[start:stop] = values
+    return scene
+
+
+def probability_map(mask, seed=0):
+    """
+    Noisy float16 probability map for a mask, like a model output before thresholding
+    """
+    rng = np.random.default_rng(seed)
+    height, width = mask.shape
+    probs = np.empty((height, width), dtype=np.float16)
+    for start in range(0, height, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, height)
+        block = mask[start:stop].astype(np.float32)
+        probs[start:stop] = 0.15 + 0.7 * block + rng.normal(0, 0.1, size=block.shape).astype(np.float32)
+    np.clip(probs, 0.0, 1.0, out=probs)
+    return probs
+
+
+def elevation_model(mask, relief=60.0, incision=4.0, seed=0):
+    """
+    float32 DEM (metres) for a channel mask: a valley sloping down along the
+    columns with rolling hills, noise, and the channel cut into the floor
+    """
+    rng = np.random.default_rng(seed)
+    height, width = mask.shape
+    x = np.arange(width, dtype=np.float32)
+    slope = 200.0 - 50.0 * x / width
+    hills_x = np.sin(2 * np.pi * x / (width / 3.0)).astype(np.float32)
+
+    dem = np.empty((height, width), dtype=np.float32)
+    for start in range(0, height, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, height)
+        y = np.arange(start, stop, dtype=np.float32)[:, None]
+        valley = relief * np.abs(2 * y / height - 1)
+        hills = 0.2 * relief * np.cos(2 * np.pi * y / (height / 2.5)) * hills_x
+        noise = rng.normal(0, 0.5, size=(stop - start, width)).astype(np.float32)
+        dem[start:stop] = slope + valley + hills + noise - incision * mask[start:stop]
+    return dem
+
+
+def make_scene(size, seed=0, migration_phase=0.3):
+    """
+    Build a benchmark scene: two epochs of channel masks, a multispectral
+    image and a probability map for the first epoch
+    """
+    mask1 = channel_mask(size, seed=seed)
+    mask2 = channel_mask(size, phase=migration_phase, seed=seed)
+    return {
+        'size': size,
+        'mask1': mask1,
+        'mask2': mask2,
+        'image': multispectral_scene(mask1, seed=seed),
+        'probs': probability_map(mask1, seed=seed),
+    }
@@ -0,0 +1,79 @@
+from utils.lazy import lazy_import
+
+tf = lazy_import('tensorflow')
+
+# Keeps the ratios defined for tiles without any channel pixels
+SMOOTH = 1.0
+
+# Probability clipping for the log terms of cross-entropy
+EPSILON = 1e-7
+
+
+def _flatten(y_true, y_pred):
+    # Overlap sums in float32 even when the model runs in bfloat16
+    y_true = tf.cast(y_true, tf.float32)
+    y_pred = tf.cast(y_pred, tf.float32)
+    batch = tf.shape(y_pred)[0]
+    return tf.reshape(y_true, [batch, -1]), tf.reshape(y_pred, [batch, -1])
+
+
+def dice_coefficient(y_true, y_pred, smooth=SMOOTH):
+    """
+    Soft Dice coefficient per tile, shape (batch,)
+    """
+    y_true, y_pred = _flatten(y_true, y_pred)
+    intersection = tf.reduce_sum(y_true * y_pred, axis=1)
+    total = tf.reduce_sum(y_true, axis=1) + tf.reduce_sum(y_pred, axis=1)
+    return (2.0 * intersection + smooth) / (total + smooth)
+
+
+def iou_score(y_true, y_pred, smooth=SMOOTH):
+    """
+    Soft Jaccard index (IoU) per tile, shape (batch,)
+    """
+    y_true, y_pred = _flatten(y_true, y_pred)
+    intersection = tf.reduce_sum(y_true * y_pred, axis=1)
+    union = tf.reduce_sum(y_true, axis=1) + tf.reduce_sum(y_pred, axis=1) - intersection
+    return (intersection + smooth) / (union + smooth)
+
+
+def dice_loss(y_true, y_pred):
+    """
+    1 - Dice. Overlap based, so thin channels covering a few percent of a
+    tile weigh as much as the background, unlike per-pixel cross-entropy.
+    """
+    return 1.0 - dice_coefficient(y_true, y_pred)
+
+
+def iou_loss(y_true, y_pred):
+    """
+    1 - soft IoU (Jaccard loss)
+    """
+    return 1.0 - iou_score(y_true, y_pred)
+
+
+def bce_dice_loss(y_true, y_pred):
+    """
+    Per-tile binary cross-entropy plus Dice loss: cross-entropy keeps the
+    gradients smooth early on, Dice keeps thin channels from being ignored
+    """
+    y_true32, y_pred32 = _flatten(y_true, y_pred)
+    y_pred32 = tf.clip_by_value(y_pred32, EPSILON, 1.0 - EPSILON)
+    bce = -tf.reduce_mean(
+        y_true32 * tf.math.log(y_pred32) + (1.0 - y_true32) * tf.math.log(1.0 - y_pred32), axis=1
+    )
+    return bce + dice_loss(y_true, y_pred)
+
+
+LOSSES = {
+    'dice': dice_loss,
+    'iou': iou_loss,
+    'bce_dice': bce_dice_loss,
+}
+
+
+def get_loss(loss):
+    """
+    Resolve a loss name from LOSSES; anything else is passed through to Keras
+    """
+    return LOSSES.get(loss, loss) if isinstance(loss, str) else loss
@@ -0,0 +1,164 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from models.tta import resolve_transforms
+from models.unet import predict, unet_model
+from utils.instrumentation import stage
+
+# Defaults can be overridden per deployment through the environment
+MAX_BATCH_SIZE = int(os.environ.get('RIVER_SERVER_MAX_BATCH', 16))
+MAX_WAIT_MS = float(os.environ.get('RIVER_SERVER_MAX_WAIT_MS', 10))
+NUM_THREADS = int(os.environ.get('RIVER_SERVER_THREADS', 0)) or None
+
+_STOP = object()
+
+
+class ModelServer:
+    """
+    Single shared model instance serving tile predictions to every session
+
+    Requests are queued and a serving thread groups them into micro-batches:
+    it waits at most max_wait_ms after the first request for more tiles, up to
+    max_batch_size, then runs one forward pass and resolves each request's
+    Future. Tiles of different shapes or TTA settings are batched separately.
+    """
+
+    def __init__(self, model_factory=unet_model, max_batch_size=MAX_BATCH_SIZE,
+                 max_wait_ms=MAX_WAIT_MS, num_threads=NUM_THREADS, cache=None):
+        self.model_factory = model_factory
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.num_threads = num_threads
+        self.cache = cache
+        self.model = None
+        self.batches_served = 0
+        self.tiles_served = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._load_error = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._serve, name='model-server', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def submit(self, tile, tta=None):
+        """
+        Queue one preprocessed tile (H, W, C) and return a Future of its (H, W) probabilities
+
+        tta selects test-time augmentation as in models.unet.predict.
+        """
+        self.start()
+        future = Future()
+        if tta:
+            tta = resolve_transforms(tta)
+        self._queue.put((np.asarray(tile, dtype=np.float32), tta or None, future))
+        return future
+
+    def predict(self, tiles, timeout=None, tta=None):
+        """
+        Predict a stack of tiles (N, H, W, C) through the shared batching queue
+        """
+        futures = [self.submit(tile, tta) for tile in tiles]
+        return np.stack([future.result(timeout) for future in futures])
+
+    def _configure_threads(self):
+        if self.num_threads is None:
+            return
+        import tensorflow as tf
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(self.num_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(max(1, self.num_threads // 4))
+        except RuntimeError:
+            # The TF runtime was already initialized elsewhere in this process
+            pass
+
+    def _collect(self, first):
+        """
+        Gather requests until the batch is full or the wait window closes
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _serve(self):
+        try:
+            self._configure_threads()
+            self.model = self.model_factory()
+        except Exception as e:
+            self._load_error = e
+
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            requests = self._collect(item)
+            requests = [(tile, tta, future) for tile, tta, future in requests
+                        if future.set_running_or_notify_cancel()]
+            if self._load_error is not None:
+                for _, _, future in requests:
+                    future.set_exception(self._load_error)
+                continue
+
+            groups = {}
+            for tile, tta, future in requests:
+                groups.setdefault((tile.shape, tta), []).append((tile, future))
+            for (_, tta), group in groups.items():
+                self._run_batch(group, tta)
+
+    def _run_batch(self, group, tta=None):
+        tiles = np.stack([tile for tile, _ in group])
+        try:
+            with stage('model_server.batch', 'inference', batch_size=len(group), tta=bool(tta)):
+                probs = predict(self.model, tiles, batch_size=len(group), cache=self.cache, tta=tta)
+        except Exception as e:
+            for _, future in group:
+                future.set_exception(e)
+            return
+        self.batches_served += 1
+        self.tiles_served += len(group)
+        for (_, future), tile_probs in zip(group, probs):
+            future.set_result(tile_probs)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_model_server(**config):
+    """
+    Return the process-wide model server, creating it on first use
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ModelServer(**config).start()
+    return _server
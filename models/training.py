@@ -0,0 +1,358 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from models.losses import get_loss
+from models.unet import compile_model, unet_model
+from utils.instrumentation import instrument, stage
+from utils.lazy import lazy_import
+from utils.prediction_cache import invalidate_weights_version
+
+tf = lazy_import('tensorflow')
+
+# CPU flags that provide native bfloat16 arithmetic
+BFLOAT16_CPU_FLAGS = ('avx512_bf16', 'amx_bf16')
+
+DEFAULT_CHECKPOINT_DIR = os.path.join('checkpoints', 'unet')
+
+
+def bfloat16_supported():
+    """
+    Whether this CPU executes bfloat16 natively (AVX512-BF16 or AMX); elsewhere
+    bfloat16 is emulated and slower than float32
+    """
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return any(flag in flags for flag in BFLOAT16_CPU_FLAGS)
+
+
+def configure_precision(mixed_precision='auto'):
+    """
+    Set the global Keras dtype policy: 'bfloat16', 'float32' or 'auto'
+    (bfloat16 where the CPU supports it). Returns the policy name.
+    """
+    if mixed_precision == 'auto':
+        mixed_precision = 'bfloat16' if bfloat16_supported() else 'float32'
+    policy = 'mixed_bfloat16' if mixed_precision == 'bfloat16' else 'float32'
+    tf.keras.mixed_precision.set_global_policy(policy)
+    return policy
+
+
+def configure_threads(threads=None):
+    """
+    Split the CPU between local workers; must run before TensorFlow executes anything
+    """
+    if not threads:
+        return
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(max(1, threads // 4))
+    except RuntimeError:
+        # The TF runtime was already initialized elsewhere in this process
+        pass
+
+
+def get_strategy():
+    """
+    MultiWorkerMirroredStrategy when TF_CONFIG describes a cluster, otherwise
+    the default single-process strategy
+    """
+    if 'TF_CONFIG' in os.environ:
+        return tf.distribute.MultiWorkerMirroredStrategy()
+    return tf.distribute.get_strategy()
+
+
+def _is_chief(strategy):
+    resolver = getattr(strategy, 'cluster_resolver', None)
+    if resolver is None or not resolver.cluster_spec().as_dict():
+        return True
+    return resolver.task_type in (None, 'chief') or (
+        resolver.task_type == 'worker' and resolver.task_id == 0)
+
+
+def _worker_checkpoint_dir(checkpoint_dir, strategy):
+    # Every worker must save, but only the chief's copy is kept
+    if _is_chief(strategy):
+        return checkpoint_dir
+    return os.path.join(checkpoint_dir, f"worker_tmp_{strategy.cluster_resolver.task_id}")
+
+
+def load_dataset(path):
+    """
+    Load training tiles from an .npz with images (N, H, W, C) and masks (N, H, W[, 1])
+
+    uint8 images are scaled to [0, 1]; masks are returned as float32 0/1.
+    """
+    with np.load(path) as data:
+        images = data['images']
+        masks = data['masks']
+    images = images.astype(np.float32) / 255.0 if images.dtype == np.uint8 else images.astype(np.float32)
+    if masks.ndim == 3:
+        masks = masks[..., np.newaxis]
+    return images, (masks > 0).astype(np.float32)
+
+
+def make_dataset(images, masks, global_batch_size, shuffle=True, seed=0, drop_remainder=True):
+    """
+    tf.data pipeline of (image, mask) batches, sharded by example across workers
+
+    Training drops the last partial batch so every step splits evenly into
+    micro-batches; evaluation keeps it so small validation sets are not empty.
+    """
+    dataset = tf.data.Dataset.from_tensor_slices((images, masks))
+    if shuffle:
+        dataset = dataset.shuffle(len(images), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(global_batch_size, drop_remainder=drop_remainder).prefetch(tf.data.AUTOTUNE)
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+    return dataset.with_options(options)
+
+
+class Trainer:
+    """
+    Data-parallel U-Net training for CPU clusters
+
+    Each optimizer step consumes accumulation_steps micro-batches per
+    replica: gradients are summed over the micro-batches inside one compiled
+    step, so activation memory is that of a single micro-batch while the
+    effective batch is micro_batch x accumulation_steps x replicas.
+    Gradients are all-reduced once per step. Model, optimizer and epoch
+    are checkpointed every epoch and training resumes from the latest
+    checkpoint automatically.
+    """
+
+    def __init__(self, input_shape=(256, 256, 3), loss='bce_dice', learning_rate=1e-3,
+                 micro_batch_size=4, accumulation_steps=1, checkpoint_dir=DEFAULT_CHECKPOINT_DIR,
+                 max_checkpoints=3, strategy=None, model_factory=unet_model):
+        self.strategy = strategy or get_strategy()
+        self.micro_batch_size = micro_batch_size
+        self.accumulation_steps = accumulation_steps
+        self.checkpoint_dir = checkpoint_dir
+        self.loss_fn = get_loss(loss)
+        if isinstance(self.loss_fn, str):
+            # Keras loss names: per-tile values are needed for replica averaging
+            self.loss_fn = tf.keras.losses.get(self.loss_fn)
+
+        with self.strategy.scope():
+            self.model = compile_model(
+                model_factory(input_shape),
+                optimizer=tf.keras.optimizers.Adam(learning_rate),
+                loss=loss
+            )
+            self.optimizer = self.model.optimizer
+            self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False, name='epoch')
+            self.checkpoint = tf.train.Checkpoint(model=self.model, optimizer=self.optimizer, epoch=self.epoch)
+
+        self._save_dir = _worker_checkpoint_dir(checkpoint_dir, self.strategy)
+        self.manager = tf.train.CheckpointManager(self.checkpoint, self._save_dir, max_to_keep=max_checkpoints)
+        self._train_step = None
+
+    @property
+    def replicas(self):
+        return self.strategy.num_replicas_in_sync
+
+    @property
+    def global_batch_size(self):
+        """
+        Examples consumed per optimizer step across all replicas
+        """
+        return self.micro_batch_size * self.accumulation_steps * self.replicas
+
+    def restore(self):
+        """
+        Resume from the latest checkpoint in checkpoint_dir, if any; returns the next epoch
+        """
+        latest = tf.train.latest_checkpoint(self.checkpoint_dir)
+        if latest:
+            self.checkpoint.restore(latest)
+            invalidate_weights_version(self.model)
+        return int(self.epoch.numpy())
+
+    def save(self):
+        path = self.manager.save(checkpoint_number=int(self.epoch.numpy()))
+        if self._save_dir != self.checkpoint_dir:
+            shutil.rmtree(self._save_dir, ignore_errors=True)
+        return path
+
+    def _replica_step(self, images, masks):
+        # Runs on each replica with images of shape (accumulation_steps * micro_batch, ...).
+        # The micro-batches go through a graph-level while loop, so the traced
+        # graph holds one forward and backward pass whatever accumulation_steps
+        # is, and parallel_iterations=1 keeps a single micro-batch's
+        # activations alive at a time.
+        variables = self.model.trainable_variables
+        micro = self.micro_batch_size
+
+        def body(step, total_loss, accumulated):
+            start = step * micro
+            x = images[start:start + micro]
+            y = masks[start:start + micro]
+            with tf.GradientTape() as tape:
+                probs = self.model(x, training=True)
+                per_tile = tf.reshape(self.loss_fn(y, probs), [micro, -1])
+                per_tile = tf.reduce_mean(tf.cast(per_tile, tf.float32), axis=1)
+                # Scaled so the all-reduced sum over replicas and micro-batches is the global mean
+                loss = tf.nn.compute_average_loss(
+                    per_tile, global_batch_size=self.global_batch_size // self.accumulation_steps
+                ) / self.accumulation_steps
+            gradients = tape.gradient(loss, variables)
+            accumulated = [total + tf.cast(grad, total.dtype) for total, grad in zip(accumulated, gradients)]
+            return step + 1, total_loss + loss, accumulated
+
+        _, total_loss, accumulated = tf.while_loop(
+            lambda step, *_: step < self.accumulation_steps,
+            body,
+            (tf.constant(0), tf.constant(0.0), [tf.zeros_like(variable) for variable in variables]),
+            parallel_iterations=1
+        )
+        self.optimizer.apply_gradients(zip(accumulated, variables))
+        return total_loss
+
+    def _build_step(self):
+        @tf.function
+        def step(batch):
+            images, masks = batch
+            losses = self.strategy.run(self._replica_step, args=(images, masks))
+            return self.strategy.reduce(tf.distribute.ReduceOp.SUM, losses, axis=None)
+        return step
+
+    @instrument(name='training.fit', category='training')
+    def fit(self, images, masks, epochs=10, validation=None, log=print):
+        """
+        Train on in-memory tiles, resuming from the last checkpoint
+
+        Returns one dict per epoch trained in this call with the mean
+        training loss, wall time and (with validation=(images, masks))
+        Keras validation metrics.
+        """
+        if len(images) < self.global_batch_size:
+            raise ValueError(
+                f"{len(images)} training tiles do not fill one global batch of {self.global_batch_size}"
+            )
+        dataset = make_dataset(images, masks, self.global_batch_size)
+        distributed = self.strategy.experimental_distribute_dataset(dataset)
+        if self._train_step is None:
+            self._train_step = self._build_step()
+
+        history = []
+        start_epoch = self.restore()
+        for epoch in range(start_epoch, epochs):
+            started = time.perf_counter()
+            total, steps = 0.0, 0
+            with stage('training.epoch', 'training', epoch=epoch):
+                for batch in distributed:
+                    total += float(self._train_step(batch))
+                    steps += 1
+            # Predictions cached under the old weights must not be reused
+            invalidate_weights_version(self.model)
+            record = {
+                'epoch': epoch + 1,
+                'loss': total / max(steps, 1),
+                'steps': steps,
+                'seconds': time.perf_counter() - started,
+            }
+            if validation is not None:
+                # Evaluated one micro-batch per replica, so validation needs no
+                # more activation memory than a training step
+                val_dataset = make_dataset(
+                    *validation, self.micro_batch_size * self.replicas, shuffle=False, drop_remainder=False
+                )
+                metrics = self.model.evaluate(val_dataset, verbose=0, return_dict=True)
+                record.update({f"val_{name}": float(value) for name, value in metrics.items()})
+
+            self.epoch.assign(epoch + 1)
+            self.save()
+            history.append(record)
+            if log is not None and _is_chief(self.strategy):
+                log(json.dumps(record))
+        return history
+
+    def export(self, path):
+        """
+        Save the trained weights (chief only), loadable into unet_model() for inference
+        """
+        if _is_chief(self.strategy):
+            self.model.save_weights(path)
+        return path
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def launch_local_workers(num_workers, args):
+    """
+    Run this module as num_workers local processes joined by a
+    MultiWorkerMirroredStrategy cluster; each gets an equal share of the cores
+    """
+    workers = [f"localhost:{_free_port()}" for _ in range(num_workers)]
+    threads = max(1, (os.cpu_count() or num_workers) // num_workers)
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ)
+        env['TF_CONFIG'] = json.dumps({
+            'cluster': {'worker': workers},
+            'task': {'type': 'worker', 'index': index},
+        })
+        command = [sys.executable, '-m', 'models.training', *args, '--workers', '1', '--threads', str(threads)]
+        processes.append(subprocess.Popen(command, env=env))
+    return max(process.wait() for process in processes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train the river channel U-Net on CPU')
+    parser.add_argument('data', help='.npz with images (N, H, W, C) and masks (N, H, W)')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=4, help='micro-batch size per worker')
+    parser.add_argument('--accumulation-steps', type=int, default=1)
+    parser.add_argument('--learning-rate', type=float, default=1e-3)
+    parser.add_argument('--loss', default='bce_dice', help="'dice', 'iou', 'bce_dice' or a Keras loss")
+    parser.add_argument('--mixed-precision', choices=['auto', 'bfloat16', 'float32'], default='auto')
+    parser.add_argument('--validation-fraction', type=float, default=0.1)
+    parser.add_argument('--checkpoint-dir', default=DEFAULT_CHECKPOINT_DIR)
+    parser.add_argument('--output', default=os.path.join('models', 'weights', 'unet.weights.h5'))
+    parser.add_argument('--workers', type=int, default=1, help='local worker processes')
+    parser.add_argument('--threads', type=int, default=0, help='intra-op threads per worker')
+    args = parser.parse_args(argv)
+
+    if args.workers > 1 and 'TF_CONFIG' not in os.environ:
+        argv = list(sys.argv[1:] if argv is None else argv)
+        return launch_local_workers(args.workers, argv)
+
+    configure_threads(args.threads)
+    policy = configure_precision(args.mixed_precision)
+    images, masks = load_dataset(args.data)
+    n_val = int(len(images) * args.validation_fraction)
+    validation = (images[:n_val], masks[:n_val]) if n_val else None
+
+    trainer = Trainer(
+        input_shape=images.shape[1:],
+        loss=args.loss,
+        learning_rate=args.learning_rate,
+        micro_batch_size=args.batch_size,
+        accumulation_steps=args.accumulation_steps,
+        checkpoint_dir=args.checkpoint_dir
+    )
+    if _is_chief(trainer.strategy):
+        print(f"Policy {policy}, {trainer.replicas} replica(s), global batch {trainer.global_batch_size}",
+              file=sys.stderr)
+    trainer.fit(images[n_val:], masks[n_val:], epochs=args.epochs, validation=validation)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    trainer.export(args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import numpy as np
+
+# The eight symmetries of a square tile: rotations by k * 90 degrees, with
+# and without a horizontal flip applied first
+DIHEDRAL_TRANSFORMS = {
+    'identity': (False, 0),
+    'rot90': (False, 1),
+    'rot180': (False, 2),
+    'rot270': (False, 3),
+    'flip': (True, 0),
+    'flip_rot90': (True, 1),
+    'flip_rot180': (True, 2),
+    'flip_rot270': (True, 3),
+}
+
+# Named subsets, from cheapest to most accurate
+TTA_PRESETS = {
+    'flips': ('identity', 'flip', 'rot180', 'flip_rot180'),
+    'all': tuple(DIHEDRAL_TRANSFORMS),
+}
+
+
+def resolve_transforms(tta):
+    """
+    Transform names for a TTA setting: a preset name, True (all eight) or a
+    sequence of names from DIHEDRAL_TRANSFORMS
+    """
+    if tta is True:
+        tta = 'all'
+    names = TTA_PRESETS.get(tta, (tta,)) if isinstance(tta, str) else tuple(tta)
+    unknown = [name for name in names if name not in DIHEDRAL_TRANSFORMS]
+    if unknown:
+        raise ValueError(f"Unknown TTA transforms: {', '.join(unknown)}")
+    if not names:
+        raise ValueError("TTA needs at least one transform")
+    return names
+
+
+def forward(tiles, name):
+    """
+    Apply a dihedral transform to a (N, H, W, ...) stack; returns a view
+    """
+    flip, turns = DIHEDRAL_TRANSFORMS[name]
+    if flip:
+        tiles = tiles[:, :, ::-1]
+    return np.rot90(tiles, turns, axes=(1, 2))
+
+
+def inverse(maps, name):
+    """
+    Undo a dihedral transform on (N, H, W, ...) model outputs; returns a view
+    """
+    flip, turns = DIHEDRAL_TRANSFORMS[name]
+    maps = np.rot90(maps, -turns, axes=(1, 2))
+    if flip:
+        maps = maps[:, :, ::-1]
+    return maps
+
+
+def augment(images, names):
+    """
+    Stack every transform of every tile into one (T * N, H, W, C) batch,
+    transform-major, ready for a single forward pass
+    """
+    height, width = images.shape[1:3]
+    if height != width and any(DIHEDRAL_TRANSFORMS[name][1] % 2 for name in names):
+        raise ValueError("90 degree rotations need square tiles")
+    batch = np.empty((len(names),) + images.shape, dtype=images.dtype)
+    for slot, name in zip(batch, names):
+        slot[...] = forward(images, name)
+    return batch.reshape((-1,) + images.shape[1:])
+
+
+def merge(probs, names, dtype=np.float16):
+    """
+    Map (T * N, H, W) predictions of an augmented batch back to the original
+    orientation and average them, accumulating in float32
+    """
+    probs = probs.reshape((len(names), -1) + probs.shape[1:])
+    total = np.zeros(probs.shape[1:], dtype=np.float32)
+    for maps, name in zip(probs, names):
+        np.add(total, inverse(maps, name), out=total)
+    total /= len(names)
+    return total.astype(dtype)
@@ -1,11 +1,21 @@
-import tensorflow as tf
-from tensorflow.keras.layers import Input, Conv2D, MaxPooling2D, UpSampling2D, concatenate
-from tensorflow.keras.models import Model
+import numpy as np
+from models.losses import dice_coefficient, get_loss, iou_score
+from models.tta import augment, merge, resolve_transforms
+from utils.instrumentation import instrument
+from utils.lazy import lazy_import
+from utils.prediction_cache import tile_key, weights_version
+from utils.processing import PROBABILITY_DTYPE
+
+# TensorFlow is only imported when a model is built or run
+tf = lazy_import('tensorflow')
 
 def unet_model(input_shape=(256, 256, 3)):
     """
     U-Net architecture for river channel detection
     """
+    from tensorflow.keras.layers import Input, Conv2D, MaxPooling2D, UpSampling2D, concatenate
+    from tensorflow.keras.models import Model
+
     inputs = Input(input_shape)
     
     # Encoder
@@ -38,20 +48,75 @@ def unet_model(input_shape=(256, 256, 3)):
     conv7 = Conv2D(64, 3, activation='relu', padding='same')(up7)
     conv7 = Conv2D(64, 3, activation='relu', padding='same')(conv7)
     
-    # Output layer
-    outputs = Conv2D(1, 1, activation='sigmoid')(conv7)
+    # Output layer, kept in float32 when training with a mixed precision policy
+    outputs = Conv2D(1, 1, activation='sigmoid', dtype='float32')(conv7)
     
     model = Model(inputs=inputs, outputs=outputs)
     
     return model
 
-def compile_model(model):
+def compile_model(model, optimizer='adam', loss='binary_crossentropy'):
     """
     Compile the U-Net model with appropriate loss and metrics
+
+    loss may be a Keras loss or one of the overlap losses in models.losses
+    ('dice', 'iou', 'bce_dice'), which suit thin channels better.
     """
     model.compile(
-        optimizer='adam',
-        loss='binary_crossentropy',
-        metrics=['accuracy', tf.keras.metrics.Precision(), tf.keras.metrics.Recall()]
+        optimizer=optimizer,
+        loss=get_loss(loss),
+        metrics=['accuracy', tf.keras.metrics.Precision(), tf.keras.metrics.Recall(),
+                 dice_coefficient, iou_score]
     )
-    return model 
\ No newline at end of file
+    return model 
+
+@instrument(name='unet.predict', category='inference')
+def predict(model, images, batch_size=8, cache=None, version=None, tta=None):
+    """
+    Run the model on preprocessed images (H, W, C) or (N, H, W, C) and return
+    float16 probability maps of shape (N, H, W)
+
+    With a PredictionCache, tiles whose content and model weights were seen
+    before are served from disk and only the misses are run through the model,
+    so threshold or postprocessing changes do not pay for inference again.
+
+    tta enables test-time augmentation: 'flips' (4 transforms), 'all' or True
+    (8), or a list of names from models.tta.DIHEDRAL_TRANSFORMS. All
+    transforms of a tile go through the model in the same forward pass and
+    the predictions are mapped back and averaged.
+    """
+    images = np.asarray(images, dtype=np.float32)
+    if images.ndim == 3:
+        images = images[np.newaxis]
+    names = resolve_transforms(tta) if tta else None
+
+    def run(tiles):
+        if names is None:
+            return model.predict(tiles, batch_size=batch_size, verbose=0)[..., 0]
+        batch = augment(tiles, names)
+        probs = model.predict(batch, batch_size=batch_size * len(names), verbose=0)[..., 0]
+        return merge(probs, names, dtype=PROBABILITY_DTYPE)
+
+    if cache is None:
+        return run(images).astype(PROBABILITY_DTYPE, copy=False)
+
+    version = version or weights_version(model)
+    if names is not None:
+        # Averaged predictions are cached per transform set
+        version = f"{version}:tta={'+'.join(names)}"
+    keys = [tile_key(image, version) for image in images]
+    probs = np.empty(images.shape[:3], dtype=PROBABILITY_DTYPE)
+    missing = []
+    for i, key in enumerate(keys):
+        cached = cache.get(key)
+        if cached is None:
+            missing.append(i)
+        else:
+            probs[i] = cached
+
+    if missing:
+        predicted = run(images[missing])
+        for i, tile_probs in zip(missing, predicted):
+            probs[i] = tile_probs
+            cache.put(keys[i], probs[i])
+    return probs
@@ -0,0 +1,67 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+pytest.importorskip('skimage')
+
+from utils.centerline import calculate_centerline_metrics
+
+PIXEL_SIZE = 30.0
+
+
+def sine_channel(width=1200, height=400, wavelength=300.0, amplitude=80.0, channel_width=8):
+    """
+    Mask of a pure sine channel, and its true centerline length (m) and sinuosity
+    """
+    x = np.arange(width, dtype=np.float64)
+    center = height / 2.0 + amplitude * np.sin(2 * np.pi * x / wavelength)
+    rows = np.arange(height)[:, None]
+    mask = (rows >= np.floor(center - channel_width / 2.0)) & (rows < np.ceil(center + channel_width / 2.0))
+    length = np.hypot(1.0, np.diff(center)).sum() * PIXEL_SIZE
+    chord = np.hypot(width - 1, center[-1] - center[0]) * PIXEL_SIZE
+    return mask, length, length / chord
+
+
+def test_sine_channel_length_and_sinuosity():
+    mask, length, sinuosity = sine_channel()
+
+    metrics = calculate_centerline_metrics(mask, pixel_size=PIXEL_SIZE)
+
+    assert len(metrics['centerlines']) == 1
+    assert metrics['main_stem_length_m'] == pytest.approx(length, rel=0.03)
+    assert metrics['channel_length_m'] == pytest.approx(length, rel=0.03)
+    assert metrics['sinuosity'] == pytest.approx(sinuosity, rel=0.03)
+    # Along-channel length of one full meander
+    assert metrics['wavelength_m'] == pytest.approx(length / 4, rel=0.1)
+
+
+def test_short_side_arm_does_not_split_main_stem():
+    mask, length, sinuosity = sine_channel()
+    # A 30 px arm off a crest, shorter than min_length
+    mask[120 - 30:120, 373:377] = True
+
+    metrics = calculate_centerline_metrics(mask, pixel_size=PIXEL_SIZE)
+
+    assert len(metrics['centerlines']) == 1
+    assert metrics['main_stem_length_m'] == pytest.approx(length, rel=0.03)
+    assert metrics['sinuosity'] == pytest.approx(sinuosity, rel=0.03)
+
+
+def test_long_side_arm_keeps_main_stem_whole():
+    mask, length, sinuosity = sine_channel()
+    # A 100 px tributary joining at a crest stays a separate centerline
+    mask[20:120, 373:377] = True
+
+    metrics = calculate_centerline_metrics(mask, pixel_size=PIXEL_SIZE)
+
+    assert len(metrics['centerlines']) >= 2
+    assert metrics['main_stem_length_m'] == pytest.approx(length, rel=0.03)
+    assert metrics['sinuosity'] == pytest.approx(sinuosity, rel=0.03)
+
+
+def test_empty_mask():
+    metrics = calculate_centerline_metrics(np.zeros((50, 50), dtype=bool))
+
+    assert metrics['centerlines'] == []
+    assert metrics['main_stem'] is None
+    assert np.isnan(metrics['sinuosity'])
@@ -0,0 +1,227 @@
+import threading
+
+import pytest
+
+from utils.ee_executor import EEExecutor, TokenBucket
+from utils.gee_utils import reduce_regions
+
+
+class FakeClock:
+    """
+    Manual clock whose sleep advances time instead of blocking
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+
+class FakeEndpoint:
+    """
+    Callable standing in for an EE request: raises the queued errors in
+    order, then returns its value
+    """
+
+    def __init__(self, value='ok', errors=(), gate=None):
+        self.value = value
+        self.errors = list(errors)
+        self.gate = gate
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args):
+        with self._lock:
+            self.calls += 1
+            error = self.errors.pop(0) if self.errors else None
+        if self.gate is not None:
+            self.gate.wait(5)
+        if error is not None:
+            raise error
+        return self.value
+
+
+class FakeComputation:
+    """
+    EE object stand-in: a serializable graph with a getInfo endpoint
+    """
+
+    def __init__(self, graph, endpoint):
+        self.graph = graph
+        self.getInfo = endpoint
+
+    def serialize(self):
+        return self.graph
+
+
+class FakeImage:
+    """
+    ee.Image stand-in whose reduceRegion returns the region's own statistics
+    """
+
+    def reduceRegion(self, reducer, geometry, scale, maxPixels):
+        return FakeComputation(f"{reducer}:{geometry}:{scale}", FakeEndpoint(value={'region': geometry}))
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def executor(clock):
+    executor = EEExecutor(max_workers=4, rate=100, max_retries=3, sleep=clock.sleep, clock=clock)
+    yield executor
+    executor.shutdown()
+
+
+def test_rate_limit_paces_requests(clock):
+    # One worker, so requests take tokens one after another
+    executor = EEExecutor(max_workers=1, rate=10, burst=2, sleep=clock.sleep, clock=clock)
+    endpoint = FakeEndpoint()
+    try:
+        futures = [executor.submit(endpoint) for _ in range(6)]
+        assert [future.result(5) for future in futures] == ['ok'] * 6
+    finally:
+        executor.shutdown()
+
+    # The burst of two is free, the remaining four wait 0.1 s each
+    assert endpoint.calls == 6
+    assert clock.sleeps == pytest.approx([0.1] * 4)
+    assert clock.now == pytest.approx(0.4)
+
+
+@pytest.mark.parametrize('message', ['Too many concurrent aggregations.', 'HTTP Error 429: Too Many Requests'])
+def test_retries_transient_errors_with_backoff(executor, clock, message):
+    endpoint = FakeEndpoint(errors=[Exception(message), Exception(message)])
+
+    assert executor.submit(endpoint).result(5) == 'ok'
+    assert endpoint.calls == 3
+    assert executor.retries == 2
+    # Two backoff sleeps, each with equal jitter within [delay / 2, delay]
+    backoffs = [s for s in clock.sleeps if s >= executor.base_delay / 2]
+    assert len(backoffs) == 2
+    assert executor.base_delay / 2 <= backoffs[0] <= executor.base_delay
+    assert executor.base_delay <= backoffs[1] <= 2 * executor.base_delay
+
+
+class FakeHttpError(Exception):
+    """
+    googleapiclient HttpError stand-in: the status lives on the response
+    """
+
+    class Response:
+        def __init__(self, status):
+            self.status = status
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.resp = self.Response(status)
+
+
+def test_retries_on_http_status(executor):
+    endpoint = FakeEndpoint(errors=[FakeHttpError(503, 'Backend error')])
+
+    assert executor.submit(endpoint).result(5) == 'ok'
+    assert endpoint.calls == 2
+    assert executor.retries == 1
+
+
+@pytest.mark.parametrize('error', [
+    ValueError("Image.load: Image asset 'users/river/scene_4290' not found."),
+    ValueError("Collection.loadTable: Table asset 'projects/x/reach-429' not found."),
+    ValueError("Computation timed out after 503.2 seconds of user CPU in a batch task."),
+    FakeHttpError(400, 'Invalid band 429 in request'),
+])
+def test_does_not_retry_status_digits_in_other_errors(executor, error):
+    endpoint = FakeEndpoint(errors=[error])
+
+    with pytest.raises(Exception):
+        executor.submit(endpoint).result(5)
+    assert endpoint.calls == 1
+    assert executor.retries == 0
+
+
+def test_gives_up_after_max_retries(executor):
+    endpoint = FakeEndpoint(errors=[Exception('Too many concurrent aggregations.')] * 10)
+
+    with pytest.raises(Exception, match='Too many concurrent'):
+        executor.submit(endpoint).result(5)
+    assert endpoint.calls == executor.max_retries + 1
+    assert executor.retries == executor.max_retries
+
+
+def test_does_not_retry_other_errors(executor, clock):
+    endpoint = FakeEndpoint(errors=[ValueError("Image.select: Band 'B99' not found.")])
+
+    with pytest.raises(ValueError, match='B99'):
+        executor.submit(endpoint).result(5)
+    assert endpoint.calls == 1
+    assert executor.retries == 0
+    assert clock.sleeps == []
+
+
+def test_coalesces_identical_pending_calls(executor):
+    gate = threading.Event()
+    endpoint = FakeEndpoint(value={'mean': 1.0}, gate=gate)
+    first = FakeComputation('graph-a', endpoint)
+    same = FakeComputation('graph-a', endpoint)
+
+    futures = [executor.evaluate(first), executor.evaluate(same)]
+    assert futures[0] is futures[1]
+    gate.set()
+
+    assert [future.result(5) for future in futures] == [{'mean': 1.0}, {'mean': 1.0}]
+    assert endpoint.calls == 1
+    assert executor.requests == 1
+    assert executor.coalesced == 1
+
+
+def test_does_not_coalesce_different_or_finished_calls(executor):
+    endpoint = FakeEndpoint()
+
+    assert executor.get_info([FakeComputation('graph-a', endpoint), FakeComputation('graph-b', endpoint)]) == ['ok', 'ok']
+    assert endpoint.calls == 2
+    # Once a call has finished, the same graph is requested again
+    assert executor.evaluate(FakeComputation('graph-a', endpoint)).result(5) == 'ok'
+    assert endpoint.calls == 3
+    assert executor.coalesced == 0
+
+
+def test_does_not_reuse_failed_call(executor):
+    endpoint = FakeEndpoint(errors=[ValueError('bad graph')])
+
+    with pytest.raises(ValueError):
+        executor.evaluate(FakeComputation('graph-a', endpoint)).result(5)
+    assert executor.evaluate(FakeComputation('graph-a', endpoint)).result(5) == 'ok'
+    assert endpoint.calls == 2
+
+
+def test_reduce_regions_keeps_region_order(executor):
+    regions = [f"region-{i}" for i in range(20)]
+
+    stats = reduce_regions(FakeImage(), regions, reducer='mean', executor=executor, timeout=5)
+
+    assert stats == [{'region': region} for region in regions]
+
+
+def test_token_bucket_refills_up_to_capacity(clock):
+    bucket = TokenBucket(rate=10, capacity=2, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+    bucket.acquire()
+
+    clock.now += 10.0
+    bucket.acquire()
+    bucket.acquire()
+    bucket.acquire()
+
+    assert clock.sleeps == pytest.approx([0.1])
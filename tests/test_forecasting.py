@@ -0,0 +1,34 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from utils.forecasting import Z_95, exponential_smoothing
+
+
+def simulated_variances(alpha, beta, horizon, paths=200000, seed=0):
+    """
+    Empirical h-step forecast error variances of the state space model behind
+    Holt's method, with unit noise and the same level/trend updates
+    """
+    rng = np.random.default_rng(seed)
+    level = np.zeros(paths)
+    trend = np.zeros(paths)
+    variances = []
+    for _ in range(horizon):
+        error = rng.standard_normal(paths)
+        variances.append(np.var(level + trend + error))
+        new_level = level + trend + alpha * error
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        level = new_level
+    return np.array(variances)
+
+
+@pytest.mark.parametrize('alpha, beta', [(0.5, 0.4), (0.3, 0.1)])
+def test_holt_intervals_match_simulation(alpha, beta):
+    horizon = 6
+    series = np.random.default_rng(1).normal(size=(1, 50)).cumsum(axis=1)
+
+    forecast = exponential_smoothing(series, alpha=alpha, beta=beta, horizon=horizon)
+
+    spread = (forecast['upper'] - forecast['mean'])[0] / (Z_95 * forecast['sigma'][0])
+    np.testing.assert_allclose(spread ** 2, simulated_variances(alpha, beta, horizon), rtol=0.02)
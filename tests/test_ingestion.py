@@ -0,0 +1,43 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+shapely = pytest.importorskip('shapely')
+
+from utils.ingestion import dissolve, fit_vertex_budget
+
+
+def scattered_discs(count, seed=0):
+    points = shapely.points(np.random.default_rng(seed).uniform(0, 50, (count, 2)))
+    return list(shapely.buffer(points, 0.01, quad_segs=16))
+
+
+def test_dissolve_keeps_every_part():
+    discs = scattered_discs(3000)
+
+    region = dissolve(discs, tolerance=0.0005, chunk_size=500, max_vertices=20000)
+
+    assert region.is_valid
+    exact = shapely.union_all(discs)
+    assert len(shapely.get_parts(region)) == len(shapely.get_parts(exact))
+    assert region.area == pytest.approx(exact.area, rel=0.05)
+
+
+def test_fit_vertex_budget_simplifies_parts():
+    region = shapely.union_all(scattered_discs(2000))
+
+    fitted, approximate = fit_vertex_budget(region, 0.0005, max_vertices=20000)
+
+    assert not approximate
+    assert fitted.geom_type == 'MultiPolygon'
+    assert len(fitted.geoms) == len(region.geoms)
+    assert shapely.get_num_coordinates(fitted) <= 20000
+
+
+def test_fit_vertex_budget_falls_back_when_parts_cannot_fit():
+    # 2000 parts need at least 8000 coordinates
+    region = shapely.union_all(scattered_discs(2000))
+
+    fitted, approximate = fit_vertex_budget(region, 0.0005, max_vertices=5000)
+
+    assert approximate
+    assert fitted.equals(region.convex_hull)
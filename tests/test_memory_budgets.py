@@ -0,0 +1,29 @@
+import pytest
+
+# The pipeline stages need the full scientific stack
+for module in ('numpy', 'scipy', 'cv2', 'skimage', 'shapely'):
+    pytest.importorskip(module)
+
+from benchmarks.run_benchmarks import MEMORY_BUDGETS, check_memory, run
+from utils.instrumentation import recorder
+
+# Large enough that the per-pixel budgets dominate MEMORY_SLACK_MB
+SCENE_SIZE = 4000
+
+
+@pytest.fixture(scope='module')
+def records():
+    # run() switches event recording off for clean measurements
+    enabled = recorder.enabled
+    try:
+        yield run([SCENE_SIZE], skip={'inference', 'preprocess_image', 'add_river_layer'})
+    finally:
+        recorder.enabled = enabled
+
+
+def test_every_budgeted_stage_is_measured(records):
+    assert set(MEMORY_BUDGETS) <= {record['stage'] for record in records}
+
+
+def test_stages_stay_within_memory_budgets(records):
+    assert check_memory(records) == []
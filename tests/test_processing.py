@@ -0,0 +1,65 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+
+from utils.processing import LABEL_DTYPE, MASK_DTYPE, label_components, postprocess_mask, remove_small_objects
+
+
+@pytest.fixture
+def probs():
+    # A large channel blob, a small speck and a hole, as float16 probabilities
+    probs = np.zeros((64, 64), dtype=np.float16)
+    probs[10:50, 10:50] = 0.9
+    probs[30:33, 30:33] = 0.1
+    probs[2:4, 60:62] = 0.8
+    return probs
+
+
+def test_postprocess_mask_returns_bool_in_out(probs):
+    out = np.empty(probs.shape, dtype=MASK_DTYPE)
+
+    mask = postprocess_mask(probs, min_size=10, out=out)
+
+    assert mask is out
+    assert mask.dtype == MASK_DTYPE
+    # Speck removed, hole filled
+    assert mask.sum() == 40 * 40
+    assert not mask[2:4, 60:62].any()
+
+
+def test_postprocess_mask_allocates_bool(probs):
+    assert postprocess_mask(probs, min_size=10).dtype == MASK_DTYPE
+
+
+def test_remove_small_objects_in_place():
+    mask = np.zeros((32, 32), dtype=bool)
+    mask[4:14, 4:14] = True
+    mask[20, 20] = True
+
+    result = remove_small_objects(mask, min_size=5, out=mask)
+
+    assert result is mask
+    assert result.dtype == MASK_DTYPE
+    assert result.sum() == 100
+    assert not result[20, 20]
+
+
+def test_remove_small_objects_accepts_uint8():
+    mask = np.zeros((16, 16), dtype=np.uint8)
+    mask[2:8, 2:8] = 1
+
+    result = remove_small_objects(mask, min_size=5)
+
+    assert result.dtype == MASK_DTYPE
+    assert result.sum() == 36
+
+
+def test_labels_are_int32():
+    mask = np.zeros((8, 8), dtype=bool)
+    mask[0, 0] = mask[7, 7] = True
+
+    labels, count = label_components(mask)
+
+    assert labels.dtype == LABEL_DTYPE
+    assert count == 2
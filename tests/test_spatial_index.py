@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip('rtree')
+
+from utils.spatial_index import SpatialIndex
+
+
+@pytest.fixture
+def spatial_index():
+    spatial_index = SpatialIndex()
+    spatial_index.add_reach('reach-1', (0, 0, 2, 2), name='upper')
+    spatial_index.add_tile('tile-1', (1, 1, 3, 3), zoom=12)
+    spatial_index.add_result('result-1', (10, 10, 11, 11))
+    return spatial_index
+
+
+def test_query_accepts_a_single_layer_name(spatial_index):
+    hits = spatial_index.query((0.5, 0.5, 1.5, 1.5), layers='tiles')
+
+    assert list(hits) == ['tiles']
+    assert [key for key, _, _ in hits['tiles']] == ['tile-1']
+
+
+def test_query_defaults_to_every_layer(spatial_index):
+    hits = spatial_index.query((0.5, 0.5, 1.5, 1.5))
+
+    assert {layer: [key for key, _, _ in items] for layer, items in hits.items()} == {
+        'reaches': ['reach-1'],
+        'tiles': ['tile-1'],
+        'results': [],
+    }
+
+
+def test_query_rejects_unknown_layers(spatial_index):
+    with pytest.raises(ValueError, match="Unknown layer 'tile'"):
+        spatial_index.query((0, 0, 1, 1), layers=['tile'])
@@ -0,0 +1,41 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from utils.terrain import TerrainMeshCache, load_dem, zoom_tolerance
+
+
+def write_hgt(path, side):
+    heights = np.add.outer(np.arange(side), np.arange(side)) % 500
+    heights.astype('>i2').tofile(path)
+
+
+@pytest.mark.parametrize('side, arc_seconds', [(1201, 3), (3601, 1)])
+def test_hgt_spacing_and_latitude_from_tile(tmp_path, side, arc_seconds):
+    path = tmp_path / 'upload.hgt'
+    write_hgt(path, side)
+
+    dem, pixel_size, latitude = load_dem(str(path), name='S12W077.hgt')
+
+    assert dem.shape == (side, side)
+    assert latitude == -11.5
+    row_step, col_step = pixel_size
+    assert row_step == pytest.approx(arc_seconds / 3600 * 111320.0)
+    assert col_step == pytest.approx(row_step * np.cos(np.radians(-11.5)))
+
+
+def test_tolerance_shrinks_with_vertical_exaggeration():
+    assert zoom_tolerance(12, 45.0, vertical_exaggeration=4.0) == pytest.approx(zoom_tolerance(12, 45.0) / 4)
+
+
+def test_exaggerated_mesh_is_finer_and_cached_separately():
+    dem = np.random.default_rng(0).normal(size=(257, 257)).cumsum(axis=0).cumsum(axis=1).astype(np.float32)
+    cache = TerrainMeshCache()
+
+    flat = cache.get(dem, 14, latitude=45.0, pixel_size=(30.0, 21.0))
+    steep = cache.get(dem, 14, latitude=45.0, pixel_size=(30.0, 21.0), vertical_exaggeration=5.0)
+
+    assert steep['tolerance'] == pytest.approx(flat['tolerance'] / 5)
+    assert len(steep['i']) > len(flat['i'])
+    assert flat['x'].max() == pytest.approx(256 * 21.0)
+    assert flat['y'].max() == pytest.approx(256 * 30.0)
@@ -0,0 +1,357 @@
+import numpy as np
+from utils.instrumentation import instrument
+from utils.lazy import lazy_import
+
+morphology = lazy_import('skimage.morphology')
+ndimage = lazy_import('scipy.ndimage')
+sparse = lazy_import('scipy.sparse')
+csgraph = lazy_import('scipy.sparse.csgraph')
+
+# 8-neighbourhood in clockwise order, starting north
+CIRCULAR_OFFSETS = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+
+# Positions in CIRCULAR_OFFSETS of the forward half of the neighbourhood
+# (E, SE, S, SW); the other half is implied by symmetry
+FORWARD = (2, 3, 4, 5)
+
+# Share of the 95th percentile absolute curvature below which bends are
+# treated as straight, so noise does not register as inflection points
+INFLECTION_THRESHOLD = 0.1
+
+# Gaussian sigma (pixels) of the light smoothing applied before measuring
+# length. Raw 8-connected pixel steps overstate the length of the curve they
+# trace by ~4%, which would inflate sinuosity by as much.
+STAIRCASE_SIGMA = 1.0
+
+
+def crop_to_content(mask):
+    """
+    Crop a mask to the bounding box of its nonzero pixels, returning (crop, (row, col) offset)
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return mask[:0, :0], (0, 0)
+    cols = np.flatnonzero(mask.any(axis=0))
+    r0, r1 = rows[0], rows[-1] + 1
+    c0, c1 = cols[0], cols[-1] + 1
+    return mask[r0:r1, c0:c1], (r0, c0)
+
+
+def neighborhood(rows, cols, width):
+    """
+    (N, 8) indices of every skeleton pixel's neighbours in clockwise order, -1 where absent
+
+    Pixels must be in row-major order (as returned by np.nonzero). Neighbours
+    are found by binary search on the flat pixel indices, so the cost is
+    O(N log N) in the number of skeleton pixels and no full-image arrays are
+    allocated.
+    """
+    flat = rows.astype(np.int64) * width + cols
+    n = flat.size
+    neighbors = np.full((n, 8), -1, dtype=np.int64)
+    if n == 0:
+        return neighbors
+    for k, (dr, dc) in enumerate(CIRCULAR_OFFSETS):
+        target = flat + dr * width + dc
+        pos = np.minimum(np.searchsorted(flat, target), n - 1)
+        valid = (flat[pos] == target) & (cols + dc >= 0) & (cols + dc < width)
+        neighbors[valid, k] = pos[valid]
+    return neighbors
+
+
+def crossing_number(neighbors):
+    """
+    Number of background-to-skeleton transitions around each pixel
+
+    1 marks an endpoint, 2 a path pixel and 3 or more a junction. Unlike a
+    plain neighbour count this does not mistake staircase corners for junctions.
+    """
+    present = neighbors >= 0
+    return np.count_nonzero(~present & np.roll(present, -1, axis=1), axis=1)
+
+
+def junction_zone(neighbors, crossings):
+    """
+    Junction pixels plus their direct neighbours
+
+    Arms meeting at a junction pixel usually also touch each other
+    diagonally, so the whole neighbourhood is cut out to separate them.
+    """
+    zone = crossings >= 3
+    around = neighbors[zone]
+    zone[around[around >= 0]] = True
+    return zone
+
+
+def edges(neighbors):
+    """
+    Undirected (src, dst, weight) edge arrays of the skeleton pixel graph
+    """
+    src, dst, weight = [], [], []
+    for k in FORWARD:
+        has = np.flatnonzero(neighbors[:, k] >= 0)
+        src.append(has)
+        dst.append(neighbors[has, k])
+        # Odd positions are diagonal neighbours
+        weight.append(np.full(has.size, np.sqrt(2.0) if k % 2 else 1.0))
+    return np.concatenate(src), np.concatenate(dst), np.concatenate(weight)
+
+
+def components(src, dst, n):
+    """
+    Number of connected components and the component label of every node
+    """
+    graph = sparse.coo_matrix((np.ones(src.size, dtype=np.int8), (src, dst)), shape=(n, n))
+    return csgraph.connected_components(graph, directed=False)
+
+
+def prune_spurs(skeleton, min_length=20, iterations=3):
+    """
+    Remove short side branches that end in a free endpoint
+
+    Junctions are cut out so the skeleton falls apart into branches;
+    branches that contain an endpoint, touch a junction and are shorter than
+    min_length pixels are dropped, as are endpoints inside a junction zone.
+    All bookkeeping is done with bincount over
+    branch labels rather than by walking pixels. Returns the (rows, cols) of
+    the pruned skeleton.
+    """
+    width = skeleton.shape[1]
+    rows, cols = np.nonzero(skeleton)
+    for _ in range(iterations):
+        neighbors = neighborhood(rows, cols, width)
+        crossings = crossing_number(neighbors)
+        junction = junction_zone(neighbors, crossings)
+        if not junction.any():
+            break
+
+        src, dst, _ = edges(neighbors)
+        inside = ~junction[src] & ~junction[dst]
+        count, labels = components(src[inside], dst[inside], rows.size)
+
+        branch = ~junction
+        sizes = np.bincount(labels[branch], minlength=count)
+        has_end = np.bincount(labels[branch & (crossings <= 1)], minlength=count) > 0
+        # Branch side of every edge joining a branch pixel to a junction pixel
+        link = junction[src] != junction[dst]
+        branch_side = np.where(junction[src[link]], dst[link], src[link])
+        touches = np.bincount(labels[branch_side], minlength=count) > 0
+
+        spur = has_end & touches & (sizes < min_length)
+        # Stubs of a pixel or two lie entirely inside the junction zone, so
+        # they form no branch of their own; drop their endpoints directly
+        stub = junction & (crossings <= 1)
+        if not spur.any() and not stub.any():
+            break
+        keep = ~(branch & spur[labels]) & ~stub
+        # Thin again to clear the stubs left at former junctions
+        skeleton = np.zeros_like(skeleton)
+        skeleton[rows[keep], cols[keep]] = True
+        skeleton = morphology.skeletonize(skeleton)
+        rows, cols = np.nonzero(skeleton)
+    return rows, cols
+
+
+def order_paths(rows, cols, width):
+    """
+    Split a skeleton at its junctions and order every piece into a polyline
+
+    One multi-source Dijkstra run from an endpoint of every piece gives each
+    pixel its distance along its own path; sorting by (piece, distance)
+    yields all polylines at once. Returns a list of (N, 2) row/col arrays.
+    """
+    neighbors = neighborhood(rows, cols, width)
+    paths = ~junction_zone(neighbors, crossing_number(neighbors))
+    rows, cols = rows[paths], cols[paths]
+    n = rows.size
+    if n == 0:
+        return []
+
+    neighbors = neighborhood(rows, cols, width)
+    src, dst, weight = edges(neighbors)
+    count, piece = components(src, dst, n)
+    is_end = crossing_number(neighbors) <= 1
+
+    # One source per piece: its first endpoint, or its first pixel for closed loops
+    order = np.lexsort((np.arange(n), ~is_end, piece))
+    first = np.r_[True, piece[order][1:] != piece[order][:-1]]
+    sources = order[first]
+
+    # Open closed loops at their source by cutting the edge to one neighbour,
+    # so distances run once around the loop instead of both ways
+    loops = sources[~is_end[sources]]
+    if loops.size:
+        loop_neighbors = neighbors[loops]
+        cut = loop_neighbors[np.arange(loops.size), np.argmax(loop_neighbors >= 0, axis=1)]
+        edge_keys = np.minimum(src, dst) * n + np.maximum(src, dst)
+        cut_keys = np.minimum(loops, cut) * n + np.maximum(loops, cut)
+        keep = ~np.isin(edge_keys, cut_keys)
+        src, dst, weight = src[keep], dst[keep], weight[keep]
+
+    graph = sparse.csr_matrix((weight, (src, dst)), shape=(n, n))
+    distance = csgraph.dijkstra(graph, directed=False, indices=sources, min_only=True)
+
+    order = np.lexsort((distance, piece))
+    coords = np.column_stack([rows, cols])[order]
+    splits = np.cumsum(np.bincount(piece, minlength=count))[:-1]
+    return np.split(coords, splits)
+
+
+def longest_path(rows, cols, width):
+    """
+    Longest path through a skeleton, as an ordered (N, 2) row/col array
+
+    Two Dijkstra sweeps over the whole pixel graph, without cutting it at
+    junctions: the pixel farthest from an arbitrary start is one end of the
+    longest path (exactly so for a tree), and the pixel farthest from that
+    end is the other. Both sweeps cover every component at once, and the
+    longest path over all components is returned. Side branches and
+    junctions therefore never split the main stem.
+    """
+    n = rows.size
+    if n == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    neighbors = neighborhood(rows, cols, width)
+    src, dst, weight = edges(neighbors)
+    graph = sparse.csr_matrix((weight, (src, dst)), shape=(n, n))
+    _, component = components(src, dst, n)
+
+    def farthest(distance):
+        # Farthest pixel of every component
+        order = np.lexsort((distance, component))
+        last = np.r_[component[order][1:] != component[order][:-1], True]
+        return order[last]
+
+    starts = np.unique(component, return_index=True)[1]
+    distance = csgraph.dijkstra(graph, directed=False, indices=starts, min_only=True)
+    ends = farthest(distance)
+    distance, predecessors, _ = csgraph.dijkstra(
+        graph, directed=False, indices=ends, min_only=True, return_predecessors=True
+    )
+
+    path = [int(np.argmax(distance))]
+    while predecessors[path[-1]] >= 0:
+        path.append(int(predecessors[path[-1]]))
+    return np.column_stack([rows, cols])[path[::-1]]
+
+
+def polyline_metrics(coords, pixel_size=30.0, smoothing=10.0):
+    """
+    Length, sinuosity, signed curvature and meander wavelength of an ordered polyline
+
+    Length is measured along the polyline after a light smoothing
+    (STAIRCASE_SIGMA) that removes the pixel staircase. Curvature is taken from the polyline after Gaussian smoothing with a
+    sigma of `smoothing` pixels, which removes the pixel staircase. Inflection
+    points are sign changes between clearly curved stretches, and the
+    wavelength is twice the median along-channel distance between them.
+    """
+    # Columns are x, rows are y, both in metres
+    xy = coords[:, ::-1].astype(np.float64) * pixel_size
+    traced = ndimage.gaussian_filter1d(xy, STAIRCASE_SIGMA, axis=0, mode='nearest') if len(xy) >= 3 else xy
+    steps = np.hypot(*np.diff(traced, axis=0).T)
+    arc = np.concatenate([[0.0], np.cumsum(steps)])
+    length = arc[-1]
+    chord = np.hypot(*(xy[-1] - xy[0]))
+
+    metrics = {
+        'coords': coords,
+        'length_m': length,
+        'sinuosity': length / chord if chord > 0 else np.nan,
+        'curvature': np.zeros(len(coords)),
+        'mean_abs_curvature': np.nan,
+        'wavelength_m': np.nan,
+    }
+    if len(coords) < 3:
+        return metrics
+
+    smooth = ndimage.gaussian_filter1d(xy, smoothing, axis=0, mode='nearest')
+    smooth_arc = np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(smooth, axis=0).T))])
+    # Keep the parameter strictly increasing for np.gradient
+    smooth_arc += np.arange(smooth_arc.size) * 1e-9
+    dx = np.gradient(smooth[:, 0], smooth_arc)
+    dy = np.gradient(smooth[:, 1], smooth_arc)
+    ddx = np.gradient(dx, smooth_arc)
+    ddy = np.gradient(dy, smooth_arc)
+    speed = np.maximum((dx * dx + dy * dy) ** 1.5, 1e-12)
+    curvature = (dx * ddy - dy * ddx) / speed
+
+    # Inflection points split the channel into half-meanders
+    threshold = INFLECTION_THRESHOLD * np.percentile(np.abs(curvature), 95)
+    curved = np.flatnonzero(np.abs(curvature) > threshold)
+    sign = np.sign(curvature[curved])
+    flips = np.flatnonzero(sign[1:] != sign[:-1])
+    inflections = (arc[curved[flips]] + arc[curved[flips + 1]]) / 2
+    half_waves = np.diff(inflections)
+
+    metrics['curvature'] = curvature
+    metrics['mean_abs_curvature'] = float(np.mean(np.abs(curvature)))
+    if half_waves.size:
+        metrics['wavelength_m'] = float(2 * np.median(half_waves))
+    return metrics
+
+
+def extract_centerlines(mask, min_spur_length=None, min_length=50):
+    """
+    Skeletonize a channel mask, prune spurs and return ordered polylines
+    (row/col pixel coordinates) of at least min_length pixels, the main stem
+    and the mean channel width in pixels
+
+    The mean width is mask area over skeleton length. Skeletonization leaves
+    spurs up to about a channel width long at bends, so by default branches
+    shorter than twice the mean width are pruned. Branches shorter than
+    min_length are pruned as well, before the skeleton is split at its
+    junctions, so an arm too short to keep cannot split the channel it
+    joins. The main stem is the longest path through the pruned skeleton
+    (see longest_path), unbroken by any remaining junctions.
+    """
+    cropped, (row_offset, col_offset) = crop_to_content(np.asarray(mask).astype(bool))
+    if cropped.size == 0:
+        return [], np.empty((0, 2), dtype=np.int64), 0.0
+    skeleton = morphology.skeletonize(cropped)
+    mean_width = np.count_nonzero(cropped) / max(np.count_nonzero(skeleton), 1)
+    if min_spur_length is None:
+        min_spur_length = max(10, int(2 * mean_width))
+
+    rows, cols = prune_spurs(skeleton, min_length=max(min_spur_length, min_length))
+    polylines = [path for path in order_paths(rows, cols, skeleton.shape[1]) if len(path) >= min_length]
+    main_stem = longest_path(rows, cols, skeleton.shape[1])
+    offset = np.array([row_offset, col_offset])
+    return [path + offset for path in polylines], main_stem + offset, mean_width
+
+
+@instrument(category='processing')
+def calculate_centerline_metrics(mask, pixel_size=30.0, min_spur_length=None, min_length=50, smoothing=None):
+    """
+    Calculate centerline-based meander metrics from a binary channel mask
+
+    Channel length sums all centerline pieces; sinuosity, wavelength and
+    curvature describe the main stem, the longest path through the
+    skeleton. Curvature is smoothed over two channel widths unless a
+    smoothing sigma (in pixels) is given.
+    """
+    polylines, main_stem, mean_width = extract_centerlines(mask, min_spur_length, min_length)
+    if smoothing is None:
+        smoothing = max(3.0, 2 * mean_width)
+    centerlines = [
+        polyline_metrics(path, pixel_size=pixel_size, smoothing=smoothing)
+        for path in polylines
+    ]
+
+    metrics = {
+        'centerlines': centerlines,
+        'channel_length_m': float(sum(line['length_m'] for line in centerlines)),
+        'mean_width_m': float(mean_width * pixel_size),
+        'main_stem': None,
+        'main_stem_length_m': np.nan,
+        'sinuosity': np.nan,
+        'wavelength_m': np.nan,
+        'mean_abs_curvature': np.nan,
+    }
+    if len(main_stem) >= 2:
+        main = polyline_metrics(main_stem, pixel_size=pixel_size, smoothing=smoothing)
+        metrics['main_stem'] = main
+        metrics['main_stem_length_m'] = float(main['length_m'])
+        metrics['sinuosity'] = main['sinuosity']
+        metrics['wavelength_m'] = main['wavelength_m']
+        metrics['mean_abs_curvature'] = main['mean_abs_curvature']
+    return metrics
@@ -0,0 +1,228 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.instrumentation import stage
+
+# Defaults can be overridden per deployment through the environment. Earth
+# Engine allows a limited number of concurrent interactive requests per user.
+MAX_WORKERS = int(os.environ.get('RIVER_EE_WORKERS', 8))
+RATE_PER_SECOND = float(os.environ.get('RIVER_EE_RATE', 10))
+MAX_RETRIES = int(os.environ.get('RIVER_EE_MAX_RETRIES', 6))
+
+# Error messages (lower case) that indicate a transient failure worth retrying
+RETRYABLE_MESSAGES = (
+    'too many concurrent',
+    'too many requests',
+    'rate limit',
+    'quota exceeded',
+    'resource exhausted',
+    'service unavailable',
+    'internal error',
+    'deadline exceeded',
+    'connection reset',
+)
+
+# HTTP statuses worth retrying. In messages they must stand alone, so asset
+# ids, paths or numbers that merely contain the digits do not match.
+RETRYABLE_STATUS = (429, 503)
+RETRYABLE_STATUS_PATTERN = re.compile(
+    r'(?<![\w/.-])(?:' + '|'.join(map(str, RETRYABLE_STATUS)) + r')(?![\w/.-])'
+)
+
+
+def status_code(error):
+    """
+    HTTP status of a googleapiclient or requests error, or None
+    """
+    candidates = [error]
+    for attr in ('resp', 'response'):
+        # requests responses are falsy for error statuses, so test for None
+        response = getattr(error, attr, None)
+        if response is not None:
+            candidates.append(response)
+    for candidate in candidates:
+        for attr in ('status_code', 'status'):
+            value = getattr(candidate, attr, None)
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                continue
+    return None
+
+
+def is_retryable(error):
+    """
+    Whether an exception from an EE call is a transient, retryable failure
+    """
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    status = status_code(error)
+    if status in RETRYABLE_STATUS:
+        return True
+    message = str(error).lower()
+    if any(pattern in message for pattern in RETRYABLE_MESSAGES):
+        return True
+    # A known status takes precedence over digits in the message
+    return status is None and RETRYABLE_STATUS_PATTERN.search(message) is not None
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`
+    """
+
+    def __init__(self, rate=RATE_PER_SECOND, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1.0):
+        """
+        Take `tokens`, sleeping until the bucket has earned them back
+
+        The tokens are reserved up front (the balance may go negative), so
+        callers queue in order and each sleeps exactly once. Re-checking
+        after the sleep could spin forever on float rounding.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            self.sleep(wait)
+
+
+def request_key(obj, method, params):
+    """
+    Coalescing key of an EE call: the serialized computation graph plus the
+    method and its parameters. Identical graphs give identical keys.
+    """
+    graph = obj.serialize() if hasattr(obj, 'serialize') else repr(obj)
+    return method, graph, json.dumps(params, sort_keys=True, default=repr)
+
+
+class EEExecutor:
+    """
+    Evaluates Earth Engine computations concurrently over a bounded thread pool
+
+    Every attempt first takes a token from a shared bucket, so the request
+    rate stays under the quota however many workers are busy. Transient
+    failures ("too many concurrent requests", 429/503) are retried with
+    exponential backoff and jitter. Calls with the same key that are still
+    pending share one Future instead of reaching the server twice.
+
+    Any callable can be submitted, which also lets a local fake endpoint
+    stand in for the EE client.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, rate=RATE_PER_SECOND, burst=None,
+                 max_retries=MAX_RETRIES, base_delay=0.5, max_delay=30.0,
+                 sleep=time.sleep, clock=time.monotonic):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.bucket = TokenBucket(rate, burst, clock=clock, sleep=sleep)
+        self.requests = 0
+        self.retries = 0
+        self.coalesced = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ee-executor')
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt):
+        """
+        Delay before retry number `attempt` (0-based): exponential with equal jitter
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _call(self, fn, args, kwargs, name):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                with stage(name, 'gee', attempt=attempt):
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+            with self._lock:
+                self.retries += 1
+            self.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def submit(self, fn, *args, key=None, name='ee.request', **kwargs):
+        """
+        Schedule fn(*args, **kwargs) and return a Future of its result
+
+        When key is given, a call whose key matches a still-pending call
+        returns that call's Future.
+        """
+        with self._lock:
+            pending = self._pending.get(key) if key is not None else None
+            # A future is marked done before its done-callbacks run, so a
+            # finished call can linger here briefly; never hand one out
+            if pending is not None and not pending.done():
+                self.coalesced += 1
+                return pending
+            self.requests += 1
+            future = self._pool.submit(self._call, fn, args, kwargs, name)
+            if key is not None:
+                self._pending[key] = future
+        if key is not None:
+            future.add_done_callback(lambda _: self._release(key, future))
+        return future
+
+    def _release(self, key, future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def evaluate(self, obj, method='getInfo', **params):
+        """
+        Schedule obj.<method>(params) on an EE object (getInfo, getDownloadURL,
+        getThumbURL, ...), coalesced on the serialized graph
+        """
+        fn = getattr(obj, method)
+        args = (params,) if params else ()
+        return self.submit(fn, *args, key=request_key(obj, method, params), name=f'ee.{method}')
+
+    def get_info(self, objects, timeout=None):
+        """
+        Evaluate many EE objects in parallel and return their values in order
+        """
+        futures = [self.evaluate(obj) for obj in objects]
+        return [future.result(timeout) for future in futures]
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_ee_executor(**config):
+    """
+    Return the process-wide EE executor, creating it on first use
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = EEExecutor(**config)
+    return _executor
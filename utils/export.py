@@ -0,0 +1,303 @@
+import csv
+import json
+import os
+import zipfile
+from itertools import chain, islice
+
+import numpy as np
+import shapely
+from shapely.geometry import LineString, Polygon, mapping
+
+from utils.ingestion import SHAPEFILE_PARTS
+from utils.instrumentation import instrument
+from utils.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+ndimage = lazy_import('scipy.ndimage')
+fiona = lazy_import('fiona')
+pq = lazy_import('pyarrow.parquet')
+pa = lazy_import('pyarrow')
+
+# Features written per batch; bounds memory whatever the size of the export
+CHUNK_SIZE = 1000
+
+# Export format -> (file extension, MIME type of the download)
+EXPORT_FORMATS = {
+    'GeoJSON': ('.geojsonl', 'application/x-ndjson'),
+    'Shapefile': ('.zip', 'application/zip'),
+    'GeoPackage': ('.gpkg', 'application/geopackage+sqlite3'),
+    'CSV': ('.csv', 'text/csv'),
+    'Parquet': ('.parquet', 'application/vnd.apache.parquet'),
+}
+
+# Formats that need a geometry on every feature
+VECTOR_FORMATS = ('Shapefile', 'GeoPackage')
+
+_FIONA_TYPES = {bool: 'int', int: 'int', float: 'float', str: 'str'}
+
+
+def chunked(iterable, size=CHUNK_SIZE):
+    """
+    Yield lists of up to `size` items from an iterable
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _native(value):
+    # numpy scalars are not JSON/fiona serializable
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def pixel_to_world(rows, cols, transform):
+    """
+    Map pixel row/col to x/y with a (x0, dx, y0, dy) transform
+    """
+    x0, dx, y0, dy = transform
+    return x0 + np.asarray(cols) * dx, y0 + np.asarray(rows) * dy
+
+
+def _ring(contour, offset, transform):
+    # Contours are (N, 1, 2) col/row points along pixel centres
+    points = contour[:, 0, :].astype(np.float64)
+    x, y = pixel_to_world(points[:, 1] + offset[0] + 0.5, points[:, 0] + offset[1] + 0.5, transform)
+    return np.column_stack([x, y])
+
+
+@instrument(category='export')
+def iter_mask_polygons(mask, transform=None, pixel_size=30.0, min_pixels=1):
+    """
+    Stream the connected regions of a channel mask as polygon features
+
+    Regions are labelled once and traced one at a time inside their own
+    bounding box, so only a single region's contours exist at any moment.
+    Boundaries follow pixel centres; holes (islands) are kept as interiors.
+    transform is (x0, dx, y0, dy) of the top-left pixel corner, as in a GDAL
+    geotransform; by default coordinates are pixel positions scaled by pixel_size.
+    """
+    transform = transform or (0.0, pixel_size, 0.0, pixel_size)
+    labels, count = ndimage.label(np.asarray(mask) > 0)
+    pixel_area = abs(transform[1] * transform[3])
+    for index, region in enumerate(ndimage.find_objects(labels), start=1):
+        if region is None:
+            continue
+        crop = (labels[region] == index).astype(np.uint8)
+        pixels = int(np.count_nonzero(crop))
+        if pixels < min_pixels:
+            continue
+        # One-pixel border so contours of regions touching the crop edge close properly
+        padded = np.pad(crop, 1)
+        contours, hierarchy = cv2.findContours(padded, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        offset = (region[0].start - 1, region[1].start - 1)
+        hierarchy = hierarchy[0]
+
+        for i, contour in enumerate(contours):
+            # Outer boundaries have no parent; their holes point back to them
+            if hierarchy[i][3] != -1 or len(contour) < 3:
+                continue
+            holes = [_ring(contours[j], offset, transform) for j in range(len(contours))
+                     if hierarchy[j][3] == i and len(contours[j]) >= 3]
+            polygon = Polygon(_ring(contour, offset, transform), holes)
+            yield {
+                'geometry': polygon,
+                'properties': {
+                    'id': index,
+                    'pixels': pixels,
+                    'area_m2': pixels * pixel_area,
+                    'perimeter_m': float(polygon.length),
+                },
+            }
+
+
+def iter_centerline_features(centerlines, transform=None, pixel_size=30.0):
+    """
+    Stream centerline polylines (see utils.centerline.calculate_centerline_metrics)
+    as line features with their per-line metrics
+    """
+    transform = transform or (0.0, pixel_size, 0.0, pixel_size)
+    for index, line in enumerate(centerlines):
+        coords = np.asarray(line['coords'])
+        if len(coords) < 2:
+            continue
+        x, y = pixel_to_world(coords[:, 0] + 0.5, coords[:, 1] + 0.5, transform)
+        yield {
+            'geometry': LineString(np.column_stack([x, y])),
+            'properties': {
+                'id': index,
+                'length_m': float(line['length_m']),
+                'sinuosity': float(line['sinuosity']),
+                'mean_abs_curvature': float(line['mean_abs_curvature']),
+                'wavelength_m': float(line['wavelength_m']),
+            },
+        }
+
+
+def iter_records(table):
+    """
+    Stream plain metric rows from a DataFrame, a dict of columns or an iterable of dicts
+    """
+    if hasattr(table, 'itertuples'):
+        columns = list(table.columns)
+        for values in table.itertuples(index=False, name=None):
+            yield {'properties': dict(zip(columns, values))}
+    elif isinstance(table, dict):
+        columns = list(table)
+        for values in zip(*table.values()):
+            yield {'properties': dict(zip(columns, values))}
+    else:
+        for row in table:
+            yield row if 'properties' in row else {'properties': row}
+
+
+def _peek(features):
+    features = iter(features)
+    first = next(features, None)
+    if first is None:
+        raise ValueError("Nothing to export")
+    return first, chain([first], features)
+
+
+def write_geojsonseq(features, path):
+    """
+    Newline-delimited GeoJSON: one Feature per line, written as it is produced
+    """
+    with open(path, 'w') as f:
+        for chunk in chunked(features):
+            lines = []
+            for feature in chunk:
+                geometry = feature.get('geometry')
+                lines.append(json.dumps({
+                    'type': 'Feature',
+                    'geometry': mapping(geometry) if geometry is not None else None,
+                    'properties': {k: _native(v) for k, v in feature['properties'].items()},
+                }))
+            f.write('\n'.join(lines) + '\n')
+    return path
+
+
+def _geometry(feature):
+    geometry = feature.get('geometry')
+    if geometry is None:
+        raise ValueError("Shapefile and GeoPackage exports need a geometry on every feature; "
+                         "use CSV or Parquet for plain tables")
+    return geometry
+
+
+def _schema(feature):
+    properties = {}
+    for name, value in feature['properties'].items():
+        properties[name] = _FIONA_TYPES.get(type(_native(value)), 'str')
+    return {'geometry': _geometry(feature).geom_type, 'properties': properties}
+
+
+def write_vector(features, path, driver='GPKG', crs=None, layer=None):
+    """
+    Shapefile or GeoPackage via fiona, written in CHUNK_SIZE batches
+
+    The schema is inferred from the first feature. Features without a
+    geometry (e.g. from iter_records) raise ValueError.
+    """
+    first, features = _peek(features)
+    schema = _schema(first)
+    with fiona.open(path, 'w', driver=driver, schema=schema, crs=crs, layer=layer) as sink:
+        for chunk in chunked(features):
+            sink.writerecords({
+                'geometry': mapping(_geometry(feature)),
+                'properties': {k: _native(v) for k, v in feature['properties'].items()},
+            } for feature in chunk)
+    return path
+
+
+def write_shapefile_zip(features, path, crs=None):
+    """
+    Shapefile written next to `path` and packed into a single zip for download
+    """
+    base = os.path.splitext(path)[0]
+    shp = base + '.shp'
+    write_vector(features, shp, driver='ESRI Shapefile', crs=crs)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for ext in SHAPEFILE_PARTS:
+            part = base + ext
+            if os.path.exists(part):
+                archive.write(part, os.path.basename(part))
+                os.remove(part)
+    return path
+
+
+def _rows(features):
+    # Flatten features into table rows, geometry as WKT
+    for feature in features:
+        row = {k: _native(v) for k, v in feature['properties'].items()}
+        geometry = feature.get('geometry')
+        if geometry is not None:
+            row['geometry'] = shapely.to_wkt(geometry)
+        yield row
+
+
+def write_csv(features, path):
+    """
+    CSV of feature properties (plus geometry as WKT), written chunk by chunk
+    """
+    first, rows = _peek(_rows(features))
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(first), extrasaction='ignore')
+        writer.writeheader()
+        for chunk in chunked(rows):
+            writer.writerows(chunk)
+    return path
+
+
+def write_parquet(features, path):
+    """
+    Parquet (requires pyarrow), one row group per chunk; geometry is stored as WKB
+    """
+    writer = None
+    try:
+        for chunk in chunked(features):
+            columns = {}
+            for name in chunk[0]['properties']:
+                columns[name] = [_native(feature['properties'].get(name)) for feature in chunk]
+            if chunk[0].get('geometry') is not None:
+                columns['geometry'] = list(shapely.to_wkb([feature['geometry'] for feature in chunk]))
+            table = pa.table(columns)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError("Nothing to export")
+    return path
+
+
+@instrument(category='export')
+def export_features(features, export_format, directory, name='export', crs=None):
+    """
+    Stream features to a file in `directory` and return (path, mime type)
+
+    export_format is a key of EXPORT_FORMATS. Nothing but the current chunk
+    is held in memory, so basin-scale exports work from generators.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    ext, mime = EXPORT_FORMATS[export_format]
+    path = os.path.join(directory, name + ext)
+
+    if export_format == 'GeoJSON':
+        write_geojsonseq(features, path)
+    elif export_format == 'Shapefile':
+        write_shapefile_zip(features, path, crs=crs)
+    elif export_format == 'GeoPackage':
+        write_vector(features, path, driver='GPKG', crs=crs, layer=name)
+    elif export_format == 'CSV':
+        write_csv(features, path)
+    else:
+        write_parquet(features, path)
+    return path, mime
@@ -0,0 +1,150 @@
+import numpy as np
+from utils.instrumentation import instrument
+
+# Two-sided 95% normal quantile used for prediction intervals
+Z_95 = 1.959964
+
+DAYS_PER_YEAR = 365.25
+
+
+def to_years(dates):
+    """
+    Convert datetime-like values (numpy datetime64, pandas DatetimeIndex, datetime)
+    to fractional years since the first date
+    """
+    days = np.asarray(dates, dtype='datetime64[D]').astype(np.float64)
+    return (days - days[0]) / DAYS_PER_YEAR
+
+
+def design_matrix(t, harmonics=1, period=1.0):
+    """
+    Columns [1, t, sin(2*pi*k*t/period), cos(2*pi*k*t/period) for k=1..harmonics]
+    """
+    t = np.asarray(t, dtype=np.float64)
+    columns = [np.ones_like(t), t]
+    for k in range(1, harmonics + 1):
+        angle = 2 * np.pi * k * t / period
+        columns += [np.sin(angle), np.cos(angle)]
+    return np.column_stack(columns)
+
+
+@instrument(category='forecast')
+def fit_trend_seasonal(series, t, harmonics=1, period=1.0):
+    """
+    Least-squares linear trend plus seasonal harmonics for many series at once
+
+    series is (n_series, n_times) and may contain NaNs for missing observations.
+    All series sharing the same missing-value pattern are solved together with
+    one lstsq call (the common case is a single pattern), so the cost is a
+    handful of matrix products rather than a Python loop over reaches.
+    Returns a dict with coefficients (n_series, n_params), residual standard
+    deviation and the number of observations per series.
+    """
+    series = np.atleast_2d(np.asarray(series, dtype=np.float64))
+    X = design_matrix(t, harmonics, period)
+    n_series, n_times = series.shape
+    n_params = X.shape[1]
+
+    coefficients = np.full((n_series, n_params), np.nan)
+    sigma = np.full(n_series, np.nan)
+    n_obs = np.zeros(n_series, dtype=np.int64)
+    # Unscaled parameter covariance (X'X)^-1 per series, for prediction intervals
+    covariance = np.full((n_series, n_params, n_params), np.nan)
+
+    observed = ~np.isnan(series)
+    patterns, pattern_index = np.unique(observed, axis=0, return_inverse=True)
+    pattern_index = np.ravel(pattern_index)
+    for p, pattern in enumerate(patterns):
+        members = np.flatnonzero(pattern_index == p)
+        count = int(pattern.sum())
+        n_obs[members] = count
+        if count < n_params:
+            continue
+        Xp = X[pattern]
+        Y = series[np.ix_(members, np.flatnonzero(pattern))].T
+        beta, _, rank, _ = np.linalg.lstsq(Xp, Y, rcond=None)
+        residuals = Y - Xp @ beta
+        dof = max(count - rank, 1)
+        coefficients[members] = beta.T
+        sigma[members] = np.sqrt(np.sum(residuals ** 2, axis=0) / dof)
+        covariance[members] = np.linalg.pinv(Xp.T @ Xp)
+
+    return {
+        'coefficients': coefficients,
+        'sigma': sigma,
+        'n_obs': n_obs,
+        'covariance': covariance,
+        'harmonics': harmonics,
+        'period': period,
+    }
+
+
+def predict_trend_seasonal(model, t_future, z=Z_95):
+    """
+    Forecast mean and prediction interval (n_series, n_future) from a fitted model
+    """
+    X = design_matrix(t_future, model['harmonics'], model['period'])
+    mean = model['coefficients'] @ X.T
+    # Parameter uncertainty x' C x for every series and horizon, plus noise
+    leverage = np.einsum('fp,spq,fq->sf', X, model['covariance'], X)
+    spread = model['sigma'][:, None] * np.sqrt(1.0 + leverage)
+    return {'mean': mean, 'lower': mean - z * spread, 'upper': mean + z * spread}
+
+
+@instrument(category='forecast')
+def exponential_smoothing(series, alpha=0.3, beta=0.1, horizon=1, z=Z_95):
+    """
+    Holt's linear exponential smoothing applied to every series in parallel
+
+    The recursion runs over time steps (not over series), each step a vector
+    operation across all reaches. Missing values carry the forecast forward.
+    Returns mean and approximate prediction intervals of shape
+    (n_series, horizon).
+    """
+    series = np.atleast_2d(np.asarray(series, dtype=np.float64))
+    n_series, n_times = series.shape
+    first = np.argmax(~np.isnan(series), axis=1)
+    level = series[np.arange(n_series), first]
+    trend = np.zeros(n_series)
+    sse = np.zeros(n_series)
+    count = np.zeros(n_series)
+
+    for i in range(1, n_times):
+        forecast = level + trend
+        value = series[:, i]
+        has = ~np.isnan(value) & (i > first)
+        error = np.where(has, value - forecast, 0.0)
+        sse += error ** 2
+        count += has
+        new_level = np.where(has, forecast + alpha * error, forecast)
+        trend = np.where(has, beta * (new_level - level) + (1 - beta) * trend, trend)
+        level = new_level
+
+    sigma = np.sqrt(sse / np.maximum(count - 2, 1))
+    steps = np.arange(1, horizon + 1, dtype=np.float64)
+    mean = level[:, None] + trend[:, None] * steps
+    # Variance growth of Holt's method for h steps ahead. The trend update
+    # smooths the level change, whose error term is already alpha * e, so the
+    # trend gain is alpha * beta and c_j = alpha * (1 + j * beta).
+    growth = np.concatenate([[0.0], np.cumsum((alpha * (1 + np.arange(1, horizon) * beta)) ** 2)])
+    spread = sigma[:, None] * np.sqrt(1 + growth)[None, :]
+    return {'mean': mean, 'lower': mean - z * spread, 'upper': mean + z * spread, 'sigma': sigma}
+
+
+def forecast_reaches(series, dates, future_dates, method='trend_seasonal', **kwargs):
+    """
+    Forecast metric series (e.g. channel width, migration, erosion) for many reaches
+
+    series is (n_reaches, n_times) aligned with dates; future_dates are the
+    forecast times. method is 'trend_seasonal' (least squares) or
+    'exponential' (Holt smoothing, one step per future date).
+    """
+    if method == 'trend_seasonal':
+        origin = np.asarray(dates, dtype='datetime64[D]')[0]
+        t = to_years(dates)
+        t_future = (np.asarray(future_dates, dtype='datetime64[D]') - origin).astype(np.float64) / DAYS_PER_YEAR
+        model = fit_trend_seasonal(series, t, **kwargs)
+        return predict_trend_seasonal(model, t_future)
+    if method == 'exponential':
+        return exponential_smoothing(series, horizon=len(future_dates), **kwargs)
+    raise ValueError(f"Unknown forecasting method '{method}'")
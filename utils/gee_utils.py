@@ -1,8 +1,10 @@
-import ee
-import numpy as np
-import pandas as pd
-from datetime import datetime, timedelta
+from utils.instrumentation import instrument
+from utils.lazy import lazy_import
 
+# Earth Engine is only imported when a GEE data source is actually used
+ee = lazy_import('ee')
+
+@instrument(category='gee')
 def get_sentinel2_collection(start_date, end_date, region):
     """
     Get Sentinel-2 imagery collection for the specified date range and region
@@ -15,6 +17,7 @@ def get_sentinel2_collection(start_date, end_date, region):
     )
     return collection
 
+@instrument(category='gee')
 def get_landsat_collection(start_date, end_date, region):
     """
     Get Landsat 8/9 imagery collection for the specified date range and region
@@ -27,6 +30,7 @@ def get_landsat_collection(start_date, end_date, region):
     )
     return collection
 
+@instrument(category='gee')
 def calculate_ndwi(image):
     """
     Calculate Normalized Difference Water Index (NDWI)
@@ -34,6 +38,7 @@ def calculate_ndwi(image):
     ndwi = image.normalizedDifference(['B3', 'B8'])
     return ndwi
 
+@instrument(category='gee')
 def calculate_ndvi(image):
     """
     Calculate Normalized Difference Vegetation Index (NDVI)
@@ -41,6 +46,7 @@ def calculate_ndvi(image):
     ndvi = image.normalizedDifference(['B8', 'B4'])
     return ndvi
 
+@instrument(category='gee')
 def get_time_series(collection, region, band='B4'):
     """
     Extract time series data for a specific band and region
@@ -59,6 +65,7 @@ def get_time_series(collection, region, band='B4'):
     time_series = collection.map(extract_values)
     return time_series
 
+@instrument(category='gee')
 def export_to_geojson(feature_collection, filename):
     """
     Export feature collection to GeoJSON
@@ -71,6 +78,7 @@ def export_to_geojson(feature_collection, filename):
     task.start()
     return task
 
+@instrument(category='gee')
 def get_river_mask(image, threshold=0.2):
     """
     Create binary mask for river channels using NDWI
@@ -79,6 +87,7 @@ def get_river_mask(image, threshold=0.2):
     river_mask = ndwi.gt(threshold)
     return river_mask
 
+@instrument(category='gee')
 def calculate_channel_width(river_mask, scale=30):
     """
     Calculate river channel width from binary mask
@@ -98,4 +107,23 @@ def calculate_channel_width(river_mask, scale=30):
         return feature.set('width', width)
     
     stats = vectors.map(calculate_stats)
-    return stats 
\ No newline at end of file
+    return stats 
+
+@instrument(category='gee')
+def reduce_regions(image, regions, reducer=None, scale=30, executor=None, timeout=None):
+    """
+    Evaluate reduceRegion statistics of an image over many regions in parallel
+
+    Each region is a separate request sent through the shared rate-limited
+    executor, so multi-region jobs are bound by concurrency rather than by
+    serial round trips. Returns one dict of band values per region.
+    """
+    from utils.ee_executor import get_ee_executor
+
+    executor = executor or get_ee_executor()
+    reducer = reducer or ee.Reducer.mean()
+    stats = [
+        image.reduceRegion(reducer=reducer, geometry=region, scale=scale, maxPixels=1e9)
+        for region in regions
+    ]
+    return executor.get_info(stats, timeout=timeout)
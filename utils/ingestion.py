@@ -0,0 +1,263 @@
+import io
+import os
+import zipfile
+from functools import lru_cache
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping, shape
+
+from utils.lazy import lazy_import
+
+fiona = lazy_import('fiona')
+pyproj = lazy_import('pyproj')
+ee = lazy_import('ee')
+
+# Extensions that make up a single vector dataset on disk
+SHAPEFILE_PARTS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+DATASET_EXTENSIONS = ('.shp', '.gpkg', '.geojson', '.json')
+
+# Metres per degree of latitude, used to express simplification tolerances
+# in the units of the output CRS (WGS84)
+METERS_PER_DEGREE = 111320.0
+
+# Vertex budget for geometries sent to Earth Engine. Large river networks
+# are simplified with increasing tolerance until they fit.
+MAX_EE_VERTICES = 50000
+
+
+def stage_uploads(uploads, directory):
+    """
+    Write uploaded files, given as (name, bytes) pairs (individual shapefile
+    parts, zip archives or GeoPackages), into a directory and return the
+    paths of the vector datasets found there
+    """
+    for name, data in uploads:
+        name = os.path.basename(name)
+        if name.lower().endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                _safe_extract(archive, directory)
+        else:
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(data)
+    return find_datasets(directory)
+
+
+def _safe_extract(archive, directory):
+    """
+    Extract a zip archive, refusing members that would escape the target directory
+    """
+    root = os.path.realpath(directory)
+    for member in archive.infolist():
+        target = os.path.realpath(os.path.join(root, member.filename))
+        if os.path.commonpath([root, target]) != root:
+            raise ValueError(f"Unsafe path in archive: {member.filename}")
+    archive.extractall(root)
+
+
+def find_datasets(directory):
+    """
+    Find readable vector datasets below a directory
+    """
+    datasets = []
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            if filename.startswith('.'):
+                continue
+            stem, ext = os.path.splitext(filename)
+            ext = ext.lower()
+            if ext not in DATASET_EXTENSIONS:
+                continue
+            if ext == '.shp':
+                missing = [part for part in ('.shx', '.dbf')
+                           if not os.path.exists(os.path.join(dirpath, stem + part))]
+                if missing:
+                    raise ValueError(
+                        f"Shapefile '{filename}' is missing required parts: {', '.join(missing)}"
+                    )
+            datasets.append(os.path.join(dirpath, filename))
+    return datasets
+
+
+@lru_cache(maxsize=32)
+def get_transformer(src_crs, dst_crs='EPSG:4326'):
+    """
+    Return a cached pyproj Transformer between two CRS definitions
+    """
+    return pyproj.Transformer.from_crs(
+        pyproj.CRS.from_user_input(src_crs), pyproj.CRS.from_user_input(dst_crs), always_xy=True
+    )
+
+
+def reproject(geometry, transformer):
+    """
+    Reproject a shapely geometry, transforming all coordinates in one vectorized call
+    """
+    def transform_coords(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack([x, y])
+
+    return shapely.transform(geometry, transform_coords)
+
+
+def iter_features(path, layer=None, dst_crs='EPSG:4326'):
+    """
+    Stream (geometry, properties) pairs from a vector dataset, reprojected to dst_crs
+    """
+    with fiona.open(path, layer=layer) as source:
+        src_crs = source.crs_wkt or 'EPSG:4326'
+        transformer = None
+        if not pyproj.CRS.from_user_input(src_crs).equals(pyproj.CRS.from_user_input(dst_crs)):
+            transformer = get_transformer(src_crs, dst_crs)
+
+        for feature in source:
+            if feature.geometry is None:
+                continue
+            geometry = shape(feature.geometry)
+            if transformer is not None:
+                geometry = reproject(geometry, transformer)
+            yield geometry, dict(feature.properties)
+
+
+def collect(parts):
+    """
+    Combine an array of single-part geometries into one geometry
+    """
+    if len(parts) == 1:
+        return parts[0]
+    types = set(shapely.get_type_id(parts).tolist())
+    if types == {shapely.GeometryType.POLYGON}:
+        return shapely.multipolygons(parts)
+    if types == {shapely.GeometryType.LINESTRING}:
+        return shapely.multilinestrings(parts)
+    return shapely.geometrycollections(parts)
+
+
+def simplify_parts(geometry, tolerance):
+    """
+    Topology-preserving simplification of every part of a geometry on its own
+
+    Simplifying a multi-part geometry as a whole checks each part against all
+    others and takes minutes for tens of thousands of parts; the parts of a
+    dissolved region are disjoint, so they are simplified in one vectorized
+    call instead. Parts closer than the tolerance may come to touch.
+    """
+    parts = shapely.get_parts(geometry)
+    if len(parts) == 0:
+        return geometry
+    return collect(shapely.simplify(parts, tolerance))
+
+
+def min_vertices(parts):
+    """
+    Fewest coordinates topology-preserving simplification can leave: a closed
+    triangle per polygon ring, two points per line, one per point
+    """
+    type_ids = shapely.get_type_id(parts)
+    rings = 1 + shapely.get_num_interior_rings(parts)
+    return int(np.select(
+        [type_ids == shapely.GeometryType.POLYGON, type_ids == shapely.GeometryType.POINT],
+        [4 * rings, 1],
+        2
+    ).sum())
+
+
+def dissolve(geometries, tolerance=0.0, chunk_size=1000, max_vertices=MAX_EE_VERTICES):
+    """
+    Simplify and union a stream of geometries in fixed-size chunks
+
+    Only one chunk of input geometries is held in memory at a time; each
+    chunk is simplified and merged into the running union. The union is
+    simplified again only when its vertex count has grown past max_vertices
+    and doubled since the last time, which keeps it bounded without
+    re-simplifying all of it for every chunk.
+    """
+    merged = None
+    chunk = []
+    limit = max_vertices
+
+    def flush(merged, chunk):
+        nonlocal limit
+        geoms = shapely.simplify(np.asarray(chunk, dtype=object), tolerance) if tolerance else chunk
+        part = shapely.union_all(geoms)
+        if merged is not None:
+            part = shapely.union(merged, part)
+        if tolerance and shapely.get_num_coordinates(part) > limit:
+            part = simplify_parts(part, tolerance)
+            limit = max(max_vertices, 2 * shapely.get_num_coordinates(part))
+        return part
+
+    for geometry in geometries:
+        if geometry is None or geometry.is_empty:
+            continue
+        chunk.append(geometry)
+        if len(chunk) >= chunk_size:
+            merged = flush(merged, chunk)
+            chunk = []
+
+    if chunk:
+        merged = flush(merged, chunk)
+    return merged
+
+
+def fit_vertex_budget(geometry, tolerance, max_vertices=MAX_EE_VERTICES):
+    """
+    Simplify a geometry with doubling tolerance until it has at most max_vertices
+
+    Each round simplifies the parts of the original geometry (see
+    simplify_parts), so errors of earlier rounds do not compound.
+    Simplification preserves topology, so every part keeps at least a
+    triangle. Once the tolerance exceeds the geometry's extent, or the parts
+    cannot get below the budget at all (see min_vertices), the geometry falls
+    back to its convex hull, or its envelope if the hull is too large as well.
+
+    Returns (geometry, approximate), where approximate is True when the
+    fallback was used and the result no longer follows the input's shape.
+    """
+    if max_vertices < 5:
+        raise ValueError(f"max_vertices must be at least 5, got {max_vertices}")
+    minx, miny, maxx, maxy = geometry.bounds
+    extent = max(maxx - minx, maxy - miny)
+    tolerance = tolerance or 1e-6
+    parts = shapely.get_parts(geometry)
+    floor = min_vertices(parts)
+    simplified = parts
+    while shapely.get_num_coordinates(simplified).sum() > max_vertices:
+        if tolerance > extent or floor > max_vertices:
+            hull = geometry.convex_hull
+            return (hull if shapely.get_num_coordinates(hull) <= max_vertices else geometry.envelope), True
+        simplified = shapely.simplify(parts, tolerance)
+        tolerance *= 2
+    return (geometry if simplified is parts else collect(simplified)), False
+
+
+def load_region(path, resolution=30, buffer_lines=True, chunk_size=1000,
+                max_vertices=MAX_EE_VERTICES):
+    """
+    Load a vector dataset as a single simplified, dissolved WGS84 region
+
+    The simplification tolerance is half the analysis resolution, so detail
+    finer than a pixel is never sent to Earth Engine. River centerlines are
+    buffered by the same amount so they become areal regions.
+
+    Returns (region, approximate) as from fit_vertex_budget.
+    """
+    tolerance = resolution / 2.0 / METERS_PER_DEGREE
+
+    def geometries():
+        for geometry, _ in iter_features(path):
+            if buffer_lines and geometry.geom_type in ('LineString', 'MultiLineString'):
+                geometry = geometry.buffer(tolerance)
+            yield geometry
+
+    region = dissolve(geometries(), tolerance=tolerance, chunk_size=chunk_size, max_vertices=max_vertices)
+    if region is None:
+        raise ValueError(f"No geometries found in {os.path.basename(path)}")
+    return fit_vertex_budget(region, tolerance, max_vertices)
+
+
+def to_ee_geometry(geometry):
+    """
+    Convert a shapely geometry to an Earth Engine geometry
+    """
+    return ee.Geometry(mapping(geometry), None, False)
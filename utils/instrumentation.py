@@ -0,0 +1,282 @@
+import functools
+import inspect
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+# Set RIVER_INSTRUMENTATION=0 to turn recording off; instrumented functions
+# then cost a single attribute check per call.
+ENABLED = os.environ.get('RIVER_INSTRUMENTATION', '1') != '0'
+
+# Set RIVER_INSTRUMENTATION_RSS=1 to sample RSS in a background thread during
+# every stage and record its true peak. Off by default: it starts a thread
+# per call.
+SAMPLE_RSS = os.environ.get('RIVER_INSTRUMENTATION_RSS', '0') == '1'
+
+# Events kept in memory. Older events are dropped first.
+MAX_EVENTS = 10000
+
+
+def current_rss():
+    """
+    Current resident set size in bytes
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+def peak_rss():
+    """
+    Process-wide peak resident set size in bytes
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def cpu_time():
+    """
+    CPU seconds used by the process: every thread (TensorFlow intra-op pools,
+    SciPy workers, ...) plus child processes that have been waited for, such
+    as a finished process pool
+    """
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+class RSSSampler:
+    """
+    Track peak resident set size while a block runs by polling /proc
+
+    ru_maxrss is a process-wide high-water mark and cannot be reset between
+    stages, so on Linux a background thread samples the current RSS instead.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def describe_arrays(values):
+    """
+    Shape, dtype and size of every array-like value (anything with shape and nbytes)
+    """
+    arrays = []
+    for value in values:
+        if hasattr(value, 'shape') and hasattr(value, 'nbytes'):
+            arrays.append({
+                'shape': list(value.shape),
+                'dtype': str(getattr(value, 'dtype', '')),
+                'mb': value.nbytes / 2**20,
+            })
+    return arrays
+
+
+class Recorder:
+    """
+    Thread-safe collector of per-call timing and memory events
+    """
+
+    def __init__(self, max_events=MAX_EVENTS, enabled=ENABLED, sample_rss=SAMPLE_RSS):
+        self.enabled = enabled
+        self.sample_rss = sample_rss
+        self._events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def record(self, event):
+        with self._lock:
+            self._events.append(event)
+
+    def now(self):
+        """
+        Current time on the clock of the events' start_s
+        """
+        return time.perf_counter() - self._origin
+
+    def events(self, since=None):
+        """
+        Recorded events, optionally only those starting at or after `since` (see now)
+        """
+        with self._lock:
+            events = list(self._events)
+        if since is not None:
+            events = [event for event in events if event['start_s'] >= since]
+        return events
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+    @contextmanager
+    def stage(self, name, category='app', **args):
+        """
+        Record wall time, CPU time and memory for the enclosed block
+
+        cpu_s is process CPU time (see cpu_time), so it includes work in
+        worker threads and pools, but also any other stage running
+        concurrently in the process. process_peak_rss_mb is the process-wide high-water mark at the end of
+        the block. With sample_rss the block's own peak is recorded as
+        peak_rss_mb.
+        """
+        if not self.enabled:
+            yield args
+            return
+
+        sampler = None
+        rss_start = current_rss()
+        cpu_start = cpu_time()
+        start = time.perf_counter()
+        try:
+            with RSSSampler() if self.sample_rss else nullcontext() as sampler:
+                yield args
+        finally:
+            wall = time.perf_counter() - start
+            cpu = cpu_time() - cpu_start
+            rss_end = current_rss()
+            event = {
+                'name': name,
+                'category': category,
+                'start_s': start - self._origin,
+                'wall_s': wall,
+                'cpu_s': cpu,
+                'rss_start_mb': rss_start / 2**20,
+                'rss_end_mb': rss_end / 2**20,
+                'process_peak_rss_mb': peak_rss() / 2**20,
+                'thread': threading.get_ident(),
+                'args': args,
+            }
+            if sampler is not None:
+                event['peak_rss_mb'] = sampler.peak / 2**20
+            self.record(event)
+
+    def instrument(self, name=None, category='app'):
+        """
+        Decorator recording a stage event for every call, including the sizes
+        of array arguments and array results
+
+        For generator functions the event spans the whole iteration, from the
+        first item to exhaustion (or close), and records the number of items.
+        Time the consumer spends between items is included.
+        """
+        def decorator(fn):
+            stage_name = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+            if inspect.isgeneratorfunction(fn):
+                @functools.wraps(fn)
+                def generator_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        yield from fn(*args, **kwargs)
+                        return
+                    with self.stage(stage_name, category) as details:
+                        inputs = describe_arrays(list(args) + list(kwargs.values()))
+                        if inputs:
+                            details['inputs'] = inputs
+                        details['items'] = 0
+                        for item in fn(*args, **kwargs):
+                            details['items'] += 1
+                            yield item
+
+                return generator_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self.stage(stage_name, category) as details:
+                    inputs = describe_arrays(list(args) + list(kwargs.values()))
+                    if inputs:
+                        details['inputs'] = inputs
+                    result = fn(*args, **kwargs)
+                    outputs = describe_arrays(result if isinstance(result, tuple) else (result,))
+                    if outputs:
+                        details['outputs'] = outputs
+                    return result
+
+            return wrapper
+        return decorator
+
+    def summary(self, since=None):
+        """
+        Aggregate events by stage name: calls, total and mean wall time, CPU time
+        and the highest process peak RSS observed, plus the highest per-call
+        peak RSS when it was sampled
+        """
+        stats = {}
+        for event in self.events(since):
+            entry = stats.setdefault(event['name'], {
+                'stage': event['name'],
+                'category': event['category'],
+                'calls': 0,
+                'wall_s': 0.0,
+                'cpu_s': 0.0,
+                'process_peak_rss_mb': 0.0,
+            })
+            entry['calls'] += 1
+            entry['wall_s'] += event['wall_s']
+            entry['cpu_s'] += event['cpu_s']
+            entry['process_peak_rss_mb'] = max(entry['process_peak_rss_mb'], event['process_peak_rss_mb'])
+            if 'peak_rss_mb' in event:
+                entry['peak_rss_mb'] = max(entry.get('peak_rss_mb', 0.0), event['peak_rss_mb'])
+        rows = sorted(stats.values(), key=lambda row: row['wall_s'], reverse=True)
+        for row in rows:
+            row['mean_wall_s'] = row['wall_s'] / row['calls']
+        return rows
+
+    def to_chrome_trace(self, since=None):
+        """
+        Export events in the Chrome trace event format (chrome://tracing, Perfetto)
+        """
+        pid = os.getpid()
+        trace_events = []
+        for event in self.events(since):
+            trace_events.append({
+                'name': event['name'],
+                'cat': event['category'],
+                'ph': 'X',
+                'ts': event['start_s'] * 1e6,
+                'dur': event['wall_s'] * 1e6,
+                'pid': pid,
+                'tid': event['thread'],
+                'args': {
+                    'cpu_s': event['cpu_s'],
+                    'rss_start_mb': event['rss_start_mb'],
+                    'rss_end_mb': event['rss_end_mb'],
+                    'process_peak_rss_mb': event['process_peak_rss_mb'],
+                    **({'peak_rss_mb': event['peak_rss_mb']} if 'peak_rss_mb' in event else {}),
+                    **event['args'],
+                },
+            })
+        return json.dumps({'traceEvents': trace_events, 'displayTimeUnit': 'ms'})
+
+
+# Process-wide recorder used by the pipeline modules
+recorder = Recorder()
+instrument = recorder.instrument
+stage = recorder.stage
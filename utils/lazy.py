@@ -0,0 +1,68 @@
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Module placeholder that performs the real import on first attribute access
+
+    Heavy dependencies (TensorFlow, Earth Engine, scikit-image, SciPy, OpenCV)
+    are bound at module level through this proxy so importing the app or the
+    utils modules does not pay for them until a function actually uses them.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_lazy_module'] is not None else 'not loaded'
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    Return the module if it is already imported, otherwise a LazyModule proxy
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+def preload(*modules):
+    """
+    Perform the real import of every lazy dependency bound in the given
+    modules, skipping ones that are not installed; returns the names loaded
+    """
+    loaded = []
+    for module in modules:
+        for value in list(vars(module).values()):
+            if isinstance(value, LazyModule):
+                try:
+                    value._load()
+                except ImportError:
+                    continue
+                loaded.append(value.__name__)
+    return loaded
+
+
+def is_loaded(name):
+    """
+    Whether a module has really been imported in this process
+    """
+    return name in sys.modules
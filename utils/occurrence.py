@@ -0,0 +1,204 @@
+import numpy as np
+from utils.instrumentation import instrument
+
+# uint16 counters overflow after this many scenes (or years)
+MAX_COUNT = np.iinfo(np.uint16).max
+
+# Occurrence bounds (percent) of the flood-risk classes
+FLOOD_RISK_CLASSES = {
+    0: 'Never flooded',
+    1: 'Rarely flooded (< 10%)',
+    2: 'Occasionally flooded (10-25%)',
+    3: 'Frequently flooded (25-75%)',
+    4: 'Permanent water (>= 75%)',
+}
+FLOOD_RISK_BOUNDS = (10.0, 25.0, 75.0)
+
+
+class WaterOccurrenceAccumulator:
+    """
+    Streaming water occurrence statistics over a sequence of per-scene water masks
+
+    Only running uint16 counts are kept (water and valid observations per
+    pixel, plus the same per year for recurrence), so multi-decade statistics
+    use constant memory and each new scene costs O(H*W). Scenes should arrive
+    grouped by year for recurrence to be meaningful.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.scenes = 0
+        self.years = 0
+        self.water_count = np.zeros(self.shape, dtype=np.uint16)
+        self.valid_count = np.zeros(self.shape, dtype=np.uint16)
+        self.water_years = np.zeros(self.shape, dtype=np.uint16)
+        self.valid_years = np.zeros(self.shape, dtype=np.uint16)
+        # Pixels seen as water / observed at all in the year being accumulated
+        self._year = None
+        self._year_water = np.zeros(self.shape, dtype=bool)
+        self._year_valid = np.zeros(self.shape, dtype=bool)
+
+    @instrument(name='occurrence.update', category='processing')
+    def update(self, water, valid=None, year=None, threshold=0.5):
+        """
+        Add one scene
+
+        water may be a boolean mask, a 0/1 mask or model probabilities (compared
+        against threshold). Invalid pixels (clouds, no data) are given by valid,
+        by the mask of a numpy masked array, or by NaNs in float input.
+        """
+        if self.scenes >= MAX_COUNT:
+            raise OverflowError(f"Accumulator holds the maximum of {MAX_COUNT} scenes")
+
+        water = np.asanyarray(water)
+        if water.shape != self.shape:
+            raise ValueError(f"Scene shape {water.shape} does not match accumulator shape {self.shape}")
+
+        if valid is None:
+            valid = ~np.ma.getmaskarray(water)
+            if np.issubdtype(water.dtype, np.floating):
+                valid &= ~np.isnan(np.ma.getdata(water))
+        else:
+            valid = np.asarray(valid, dtype=bool)
+        water = np.ma.getdata(water)
+        if water.dtype != bool:
+            water = water > threshold if np.issubdtype(water.dtype, np.floating) else water != 0
+        # Not in place: the caller's mask must stay untouched
+        water = water & valid
+
+        if year is not None and year != self._year:
+            self._close_year()
+            self._year = year
+
+        self.water_count += water
+        self.valid_count += valid
+        self._year_water |= water
+        self._year_valid |= valid
+        self.scenes += 1
+        return self
+
+    def _close_year(self):
+        if self._year is None:
+            return
+        if self.years >= MAX_COUNT:
+            raise OverflowError(f"Accumulator holds the maximum of {MAX_COUNT} years")
+        self.water_years += self._year_water
+        self.valid_years += self._year_valid
+        self.years += 1
+        self._year_water[...] = False
+        self._year_valid[...] = False
+
+    def finalize_year(self):
+        """
+        Fold the year in progress into the recurrence counts
+        """
+        self._close_year()
+        self._year = None
+        return self
+
+    def merge(self, other):
+        """
+        Combine counts from an accumulator over the same grid (e.g. another worker's years)
+        """
+        if other.shape != self.shape:
+            raise ValueError("Cannot merge accumulators with different shapes")
+        self.finalize_year()
+        other.finalize_year()
+        if max(self.scenes + other.scenes, self.years + other.years) > MAX_COUNT:
+            raise OverflowError("Merged counts would overflow uint16")
+        self.water_count += other.water_count
+        self.valid_count += other.valid_count
+        self.water_years += other.water_years
+        self.valid_years += other.valid_years
+        self.scenes += other.scenes
+        self.years += other.years
+        return self
+
+    @staticmethod
+    def _percent(numerator, denominator):
+        out = np.full(numerator.shape, np.nan, dtype=np.float32)
+        np.divide(numerator, denominator, out=out, where=denominator > 0)
+        out *= 100
+        return out
+
+    def occurrence(self):
+        """
+        Percent of valid observations in which each pixel was water (NaN if never observed)
+        """
+        return self._percent(self.water_count, self.valid_count)
+
+    def recurrence(self):
+        """
+        Percent of observed years in which each pixel was water at least once
+        """
+        water_years = self.water_years + self._year_water
+        valid_years = self.valid_years + self._year_valid
+        return self._percent(water_years, valid_years)
+
+    def max_extent(self):
+        """
+        Pixels that were water in at least one scene
+        """
+        return self.water_count > 0
+
+    def flood_risk(self):
+        """
+        uint8 class map (see FLOOD_RISK_CLASSES) from water occurrence
+        """
+        occurrence = np.nan_to_num(self.occurrence(), nan=0.0)
+        classes = np.digitize(occurrence, FLOOD_RISK_BOUNDS).astype(np.uint8) + 1
+        classes[~self.max_extent()] = 0
+        return classes
+
+    def save(self, path):
+        """
+        Persist the running counts so a nightly job can resume with the next scene
+        """
+        np.savez_compressed(
+            path,
+            scenes=self.scenes,
+            years=self.years,
+            water_count=self.water_count,
+            valid_count=self.valid_count,
+            water_years=self.water_years,
+            valid_years=self.valid_years,
+            year=np.array(self._year if self._year is not None else -1),
+            year_water=self._year_water,
+            year_valid=self._year_valid,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            accumulator = cls(data['water_count'].shape)
+            accumulator.scenes = int(data['scenes'])
+            accumulator.years = int(data['years'])
+            accumulator.water_count[...] = data['water_count']
+            accumulator.valid_count[...] = data['valid_count']
+            accumulator.water_years[...] = data['water_years']
+            accumulator.valid_years[...] = data['valid_years']
+            year = data['year'].item()
+            accumulator._year = None if year == -1 else year
+            accumulator._year_water[...] = data['year_water']
+            accumulator._year_valid[...] = data['year_valid']
+        return accumulator
+
+
+def accumulate_occurrence(scenes, shape=None):
+    """
+    Build an accumulator from an iterable of water masks or (year, water[, valid]) tuples
+    """
+    accumulator = None
+    for scene in scenes:
+        year, valid = None, None
+        if isinstance(scene, tuple):
+            year, water, *rest = scene
+            valid = rest[0] if rest else None
+        else:
+            water = scene
+        if accumulator is None:
+            accumulator = WaterOccurrenceAccumulator(shape or np.shape(water))
+        accumulator.update(water, valid=valid, year=year)
+    if accumulator is None:
+        raise ValueError("No scenes to accumulate")
+    return accumulator.finalize_year()
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'RIVER_PREDICTION_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'river_morphology', 'predictions')
+)
+DEFAULT_MAX_BYTES = 2 * 2**30
+
+# Weight fingerprints are expensive to compute (tens of MB hashed), so they
+# are remembered per model object until invalidate_weights_version is called
+_weight_versions = weakref.WeakKeyDictionary()
+
+
+def weights_version(model):
+    """
+    Fingerprint of a Keras model's weights, so cached predictions are never
+    reused after the model is retrained or reloaded with different weights
+
+    The fingerprint is remembered per model object. Code that changes a
+    model's weights in place (fit, load_weights, checkpoint restore) must
+    call invalidate_weights_version afterwards.
+    """
+    try:
+        return _weight_versions[model]
+    except (KeyError, TypeError):
+        pass
+    digest = hashlib.blake2b(digest_size=16)
+    for weights in model.get_weights():
+        digest.update(str(weights.shape).encode())
+        digest.update(np.ascontiguousarray(weights).tobytes())
+    version = digest.hexdigest()
+    try:
+        _weight_versions[model] = version
+    except TypeError:
+        pass
+    return version
+
+
+def invalidate_weights_version(model):
+    """
+    Forget the remembered fingerprint of a model whose weights changed in place
+    """
+    try:
+        _weight_versions.pop(model, None)
+    except TypeError:
+        pass
+
+
+def tile_key(tile, version):
+    """
+    Cache key for one input tile under a given model weights version
+    """
+    tile = np.ascontiguousarray(tile)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(version.encode())
+    digest.update(f"{tile.shape}{tile.dtype.str}".encode())
+    digest.update(tile.data)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    On-disk LRU cache of float16 probability tiles keyed by input content hash
+
+    Entries are plain .npy files. Recency is tracked in memory and mirrored in
+    file modification times, so the LRU order survives restarts.
+    """
+
+    suffix = '.npy'
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def _load_index(self):
+        files = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(self.suffix):
+                    stat = os.stat(os.path.join(dirpath, filename))
+                    files.append((stat.st_mtime, filename[:-len(self.suffix)], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._size += size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def size_bytes(self):
+        return self._size
+
+    def get(self, key):
+        """
+        Return the cached float16 probabilities for a key, or None
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            probs = self._read(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return probs
+
+    def put(self, key, probs):
+        """
+        Store probabilities as float16 and evict least recently used entries over budget
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique per process and thread: several app workers can share a cache directory
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            self._write(f, probs)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = size
+            self._size += size
+            self._evict()
+
+    def _read(self, path):
+        return np.load(path)
+
+    def _write(self, f, probs):
+        np.save(f, np.asarray(probs, dtype=np.float16))
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove_file(key)
+                self._forget(key)
+
+    def _forget(self, key):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._size -= size
+
+    def _remove_file(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self._remove_file(key)
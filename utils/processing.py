@@ -1,59 +1,135 @@
 import numpy as np
-import cv2
-from skimage import measure
-from scipy import ndimage
+from utils.instrumentation import instrument
+from utils.lazy import lazy_import
 
-def preprocess_image(image, target_size=(256, 256)):
+# Imported on first use to keep app cold start fast
+cv2 = lazy_import('cv2')
+measure = lazy_import('skimage.measure')
+ndimage = lazy_import('scipy.ndimage')
+
+# Pipeline dtype policy: probabilities are stored as float16, masks as bool,
+# connected-component labels as int32. Model input stays float32.
+INPUT_DTYPE = np.float32
+PROBABILITY_DTYPE = np.float16
+MASK_DTYPE = np.bool_
+LABEL_DTYPE = np.int32
+
+# 8-connectivity, as used by skimage.measure.label on 2D masks
+CONNECTIVITY = np.ones((3, 3), dtype=bool)
+
+# Pixels per block for operations that would otherwise make int64 copies
+BLOCK_PIXELS = 1 << 20
+
+
+def as_mask(mask):
+    """
+    View a mask as bool without copying when it is already bool or 0/1 uint8
+    """
+    mask = np.asarray(mask)
+    if mask.dtype == MASK_DTYPE:
+        return mask
+    if mask.dtype == np.uint8 and mask.max(initial=0) <= 1:
+        return mask.view(MASK_DTYPE)
+    return mask != 0
+
+
+def as_uint8(mask):
+    """
+    0/1 uint8 view of a bool mask for OpenCV, which has no bool type
+    """
+    mask = np.asarray(mask)
+    if mask.dtype == MASK_DTYPE:
+        return mask.view(np.uint8)
+    if mask.dtype == np.uint8:
+        return mask
+    return (mask != 0).view(np.uint8)
+
+
+def label_components(mask, out=None):
+    """
+    int32 labels of the 8-connected components of a mask, and their count
+    """
+    if out is None:
+        out = np.empty(np.shape(mask), dtype=LABEL_DTYPE)
+    count = ndimage.label(as_mask(mask), structure=CONNECTIVITY, output=out)
+    return out, count
+
+
+@instrument(category='processing')
+def preprocess_image(image, target_size=(256, 256), out=None):
     """
     Preprocess image for model input
+
+    Resizing happens on the original (usually uint8) pixels and scaling to
+    [0, 1] writes straight into out, e.g. a slot of a preallocated batch,
+    so there is a single float32 allocation (none with out).
     """
     # Resize image
-    image = cv2.resize(image, target_size)
+    if image.shape[1::-1] != tuple(target_size):
+        image = cv2.resize(image, target_size)
     
     # Normalize pixel values
-    image = image.astype(np.float32) / 255.0
+    if out is None:
+        out = np.empty(image.shape, dtype=INPUT_DTYPE)
+    np.multiply(image, INPUT_DTYPE(1.0 / 255.0), out=out, casting='unsafe')
     
-    return image
+    return out
 
-def postprocess_mask(mask, threshold=0.5):
+@instrument(category='processing')
+def postprocess_mask(mask, threshold=0.5, min_size=100, out=None):
     """
     Postprocess model output mask
+
+    Takes probabilities (float16 or float32) and returns a bool mask. All
+    steps run in place on the one bool array (out if given).
     """
     # Apply threshold
-    binary_mask = (mask > threshold).astype(np.uint8)
+    binary_mask = np.greater(mask, threshold, out=out)
     
     # Remove small objects
-    binary_mask = remove_small_objects(binary_mask, min_size=100)
+    remove_small_objects(binary_mask, min_size=min_size, out=binary_mask)
     
     # Fill holes
-    binary_mask = ndimage.binary_fill_holes(binary_mask)
+    ndimage.binary_fill_holes(binary_mask, output=binary_mask)
     
     return binary_mask
 
-def remove_small_objects(mask, min_size=100):
+@instrument(category='processing')
+def remove_small_objects(mask, min_size=100, out=None):
     """
     Remove small objects from binary mask
+
+    Component sizes come from one bincount over int32 labels and the kept
+    components are selected with a single lookup, so the cost does not grow
+    with the number of objects. Returns a bool mask (out may be the input).
     """
     # Label connected components
-    labeled_mask = measure.label(mask)
-    
-    # Get properties of each region
-    props = measure.regionprops(labeled_mask)
-    
-    # Create new mask without small objects
-    new_mask = np.zeros_like(mask)
-    for prop in props:
-        if prop.area >= min_size:
-            new_mask[labeled_mask == prop.label] = 1
-    
-    return new_mask
+    labeled_mask, count = label_components(mask)
+    
+    # Keep components of at least min_size pixels (label 0 is background).
+    # bincount and take cast indices to int64, so both run in row blocks to
+    # keep that copy small.
+    rows = max(1, BLOCK_PIXELS // max(labeled_mask.shape[1], 1))
+    sizes = np.zeros(count + 1, dtype=np.int64)
+    for start in range(0, labeled_mask.shape[0], rows):
+        sizes += np.bincount(labeled_mask[start:start + rows].ravel(), minlength=count + 1)
+    keep = sizes >= min_size
+    keep[0] = False
+    
+    if out is None:
+        out = np.empty(labeled_mask.shape, dtype=MASK_DTYPE)
+    for start in range(0, labeled_mask.shape[0], rows):
+        np.take(keep, labeled_mask[start:start + rows], out=out[start:start + rows], mode='clip')
+    
+    return out
 
+@instrument(category='processing')
 def calculate_morphological_metrics(mask):
     """
     Calculate morphological metrics from binary mask
     """
     # Label connected components
-    labeled_mask = measure.label(mask)
+    labeled_mask, _ = label_components(mask)
     props = measure.regionprops(labeled_mask)
     
     metrics = {
@@ -71,34 +147,42 @@ def calculate_morphological_metrics(mask):
     
     return metrics
 
-def detect_meander_shifts(mask1, mask2):
+@instrument(category='processing')
+def detect_meander_shifts(mask1, mask2, threshold=5, out=None):
     """
     Detect meander shifts between two masks
+
+    The difference is taken in place in the first distance map, so only
+    the two float32 maps OpenCV produces are allocated.
     """
     # Calculate distance transform
-    dist1 = cv2.distanceTransform(mask1, cv2.DIST_L2, 5)
-    dist2 = cv2.distanceTransform(mask2, cv2.DIST_L2, 5)
+    dist1 = cv2.distanceTransform(as_uint8(mask1), cv2.DIST_L2, 5)
+    dist2 = cv2.distanceTransform(as_uint8(mask2), cv2.DIST_L2, 5)
     
     # Calculate difference
-    diff = np.abs(dist1 - dist2)
+    np.subtract(dist1, dist2, out=dist1)
+    np.abs(dist1, out=dist1)
+    del dist2
     
     # Threshold to get significant changes
-    significant_changes = diff > 5
+    significant_changes = np.greater(dist1, threshold, out=out)
     
     return significant_changes
 
+@instrument(category='processing')
 def calculate_erosion_deposition(mask1, mask2):
     """
     Calculate erosion and deposition areas
     """
-    # Erosion (areas in mask1 but not in mask2)
-    erosion = np.logical_and(mask1, np.logical_not(mask2))
+    mask1 = as_mask(mask1)
+    mask2 = as_mask(mask2)
     
-    # Deposition (areas in mask2 but not in mask1)
-    deposition = np.logical_and(mask2, np.logical_not(mask1))
+    # Erosion (areas in mask1 but not in mask2) and deposition (the reverse)
+    # from pixel counts, with a single temporary for the overlap
+    overlap = np.count_nonzero(np.logical_and(mask1, mask2))
     
     # Calculate areas
-    erosion_area = np.sum(erosion)
-    deposition_area = np.sum(deposition)
+    erosion_area = np.count_nonzero(mask1) - overlap
+    deposition_area = np.count_nonzero(mask2) - overlap
     
-    return erosion_area, deposition_area 
\ No newline at end of file
+    return erosion_area, deposition_area
@@ -0,0 +1,259 @@
+import base64
+import hashlib
+import html
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from utils.instrumentation import instrument, stage
+from utils.lazy import lazy_import
+from utils.prediction_cache import PredictionCache
+
+Image = lazy_import('PIL.Image')
+ImageDraw = lazy_import('PIL.ImageDraw')
+ImageFont = lazy_import('PIL.ImageFont')
+
+DEFAULT_FIGURE_CACHE_DIR = os.environ.get(
+    'RIVER_FIGURE_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'river_morphology', 'figures')
+)
+DEFAULT_FIGURE_CACHE_BYTES = 512 * 2**20
+REPORT_WORKERS = int(os.environ.get('RIVER_REPORT_WORKERS', 0)) or None
+
+# Static figure size (px at scale 1) and PDF page size (A4 at 150 dpi)
+FIGURE_WIDTH = 1000
+FIGURE_HEIGHT = 500
+PAGE_SIZE = (1240, 1754)
+PAGE_MARGIN = 80
+PDF_RESOLUTION = 150.0
+
+ASU_MAROON = '#8C1D40'
+
+
+class FigureCache(PredictionCache):
+    """
+    On-disk LRU cache of rendered figure images keyed by figure content hash
+
+    Same storage and eviction as the prediction cache, holding raw image bytes.
+    """
+
+    suffix = '.img'
+
+    def __init__(self, directory=DEFAULT_FIGURE_CACHE_DIR, max_bytes=DEFAULT_FIGURE_CACHE_BYTES):
+        super().__init__(directory, max_bytes)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _write(self, f, image):
+        f.write(image)
+
+
+def figure_key(fig_json, fmt='png', width=FIGURE_WIDTH, height=FIGURE_HEIGHT, scale=1.0):
+    """
+    Cache key of a rendered figure: its full JSON spec plus the output settings
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{fmt}:{width}x{height}@{scale}".encode())
+    digest.update(fig_json.encode())
+    return digest.hexdigest()
+
+
+def _render(fig_json, fmt, width, height, scale):
+    # Runs in a worker process; figures travel as JSON
+    import plotly.io as pio
+    return pio.from_json(fig_json).to_image(format=fmt, width=width, height=height, scale=scale)
+
+
+@instrument(category='report')
+def render_figures(figures, fmt='png', width=FIGURE_WIDTH, height=FIGURE_HEIGHT, scale=1.0,
+                   cache=None, max_workers=REPORT_WORKERS):
+    """
+    Render Plotly figures to static images, in parallel across processes
+
+    Figures are identified by the hash of their JSON spec. Cached images are
+    reused, identical figures are rendered once, and the remaining ones are
+    spread over a process pool (static export is CPU bound and single
+    threaded per figure). Requires kaleido. Returns image bytes in order.
+    """
+    specs = [fig if isinstance(fig, str) else fig.to_json() for fig in figures]
+    keys = [figure_key(spec, fmt, width, height, scale) for spec in specs]
+    images = {}
+    if cache is not None:
+        for key in set(keys):
+            image = cache.get(key)
+            if image is not None:
+                images[key] = image
+
+    missing = {key: spec for key, spec in zip(keys, specs) if key not in images}
+    if len(missing) == 1 or max_workers == 1:
+        rendered = [_render(spec, fmt, width, height, scale) for spec in missing.values()]
+    elif missing:
+        workers = min(len(missing), max_workers or os.cpu_count() or 1)
+        # spawn: forking a process that holds Streamlit/TF threads is unsafe
+        context = multiprocessing.get_context('spawn')
+        with stage('report.render_pool', 'report', figures=len(missing), workers=workers):
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                rendered = list(pool.map(
+                    _render, missing.values(),
+                    [fmt] * len(missing), [width] * len(missing),
+                    [height] * len(missing), [scale] * len(missing)
+                ))
+    else:
+        rendered = []
+
+    for key, image in zip(missing, rendered):
+        images[key] = image
+        if cache is not None:
+            cache.put(key, image)
+    return [images[key] for key in keys]
+
+
+def _metric_cards_html(metrics):
+    cards = []
+    for title, rows in metrics.items():
+        items = ''.join(
+            f"<tr><td>{html.escape(label)}</td><td><b>{html.escape(str(value))}</b></td>"
+            f"<td class='delta'>{html.escape(str(delta))}</td></tr>"
+            for label, value, delta in rows
+        )
+        cards.append(f"<div class='card'><h3>{html.escape(title)}</h3><table>{items}</table></div>")
+    return f"<div class='cards'>{''.join(cards)}</div>"
+
+
+def build_html_report(report, images=None):
+    """
+    Self-contained HTML report
+
+    report is a dict with 'title', optional 'subtitle', 'metrics'
+    ({card title: [(label, value, delta), ...]}), 'figures' ([(caption,
+    plotly figure), ...]) and 'maps' ([(caption, folium map), ...]). With
+    images (PNG bytes per figure) figures are embedded as static images,
+    otherwise as interactive Plotly divs.
+    """
+    title = html.escape(report['title'])
+    parts = [
+        f"<h1>{title}</h1>",
+        f"<p class='subtitle'>{html.escape(report.get('subtitle', ''))}</p>",
+        _metric_cards_html(report.get('metrics', {})),
+    ]
+    for index, (caption, fig) in enumerate(report.get('figures', [])):
+        if images is not None:
+            encoded = base64.b64encode(images[index]).decode('ascii')
+            body = f"<img src='data:image/png;base64,{encoded}' alt='{html.escape(caption)}'>"
+        else:
+            body = fig.to_html(full_html=False, include_plotlyjs='cdn' if index == 0 else False)
+        parts.append(f"<figure>{body}<figcaption>{html.escape(caption)}</figcaption></figure>")
+    for caption, map_obj in report.get('maps', []):
+        parts.append(f"<figure>{map_obj._repr_html_()}<figcaption>{html.escape(caption)}</figcaption></figure>")
+
+    style = (
+        "body{font-family:sans-serif;margin:40px;color:#222}"
+        f"h1{{color:{ASU_MAROON}}}"
+        ".cards{display:flex;flex-wrap:wrap;gap:16px}"
+        f".card{{border-left:4px solid {ASU_MAROON};padding:8px 16px;background:#f8f8f8;min-width:320px}}"
+        "td{padding:2px 8px}.delta{color:#666}"
+        "figure{margin:24px 0}img{max-width:100%}figcaption{color:#666}"
+    )
+    return (
+        f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>{title}</title>"
+        f"<style>{style}</style></head><body>{''.join(parts)}</body></html>"
+    )
+
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 has a single fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def _metrics_page(report):
+    page = Image.new('RGB', PAGE_SIZE, 'white')
+    draw = ImageDraw.Draw(page)
+    y = PAGE_MARGIN
+    draw.text((PAGE_MARGIN, y), report['title'], fill=ASU_MAROON, font=_font(48))
+    y += 70
+    draw.text((PAGE_MARGIN, y), report.get('subtitle', ''), fill='#666666', font=_font(24))
+    y += 70
+    for title, rows in report.get('metrics', {}).items():
+        draw.text((PAGE_MARGIN, y), title, fill=ASU_MAROON, font=_font(32))
+        y += 48
+        for label, value, delta in rows:
+            draw.text((PAGE_MARGIN + 20, y), label, fill='black', font=_font(24))
+            draw.text((PAGE_MARGIN + 560, y), str(value), fill='black', font=_font(24))
+            draw.text((PAGE_MARGIN + 820, y), str(delta), fill='#666666', font=_font(24))
+            y += 36
+        y += 24
+    return page
+
+
+def build_pdf_report(report, images):
+    """
+    PDF report: a metrics page followed by the rendered figures, two per page
+
+    Maps are interactive only and are left out of the PDF.
+    """
+    pages = [_metrics_page(report)]
+    width = PAGE_SIZE[0] - 2 * PAGE_MARGIN
+    page, y = None, None
+    for (caption, _), image_bytes in zip(report.get('figures', []), images):
+        image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+        height = int(image.height * width / image.width)
+        image = image.resize((width, height))
+        if page is None or y + height + 60 > PAGE_SIZE[1] - PAGE_MARGIN:
+            page = Image.new('RGB', PAGE_SIZE, 'white')
+            pages.append(page)
+            y = PAGE_MARGIN
+        page.paste(image, (PAGE_MARGIN, y))
+        ImageDraw.Draw(page).text((PAGE_MARGIN, y + height + 10), caption, fill='#666666', font=_font(22))
+        y += height + 60
+
+    out = io.BytesIO()
+    pages[0].save(out, 'PDF', save_all=True, append_images=pages[1:], resolution=PDF_RESOLUTION)
+    return out.getvalue()
+
+
+@instrument(category='report')
+def build_reports(reports, fmt='pdf', interactive=False, cache=None, max_workers=REPORT_WORKERS):
+    """
+    Build many reports (e.g. one per reach) and return their bytes in order
+
+    The figures of all reports are rendered in a single parallel pass, so a
+    monthly run over hundreds of reaches keeps every worker busy, and only
+    figures whose content changed since the last run are rendered again.
+    fmt is 'pdf' or 'html'; interactive HTML reports skip static rendering.
+    """
+    for report in reports:
+        report.setdefault('subtitle', f"Generated {datetime.now():%Y-%m-%d %H:%M}")
+
+    static = fmt == 'pdf' or not interactive
+    images = []
+    if static:
+        figures = [fig for report in reports for _, fig in report.get('figures', [])]
+        images = render_figures(figures, cache=cache, max_workers=max_workers)
+
+    outputs = []
+    offset = 0
+    for report in reports:
+        count = len(report.get('figures', []))
+        report_images = images[offset:offset + count] if static else None
+        offset += count
+        if fmt == 'pdf':
+            outputs.append(build_pdf_report(report, report_images))
+        elif fmt == 'html':
+            outputs.append(build_html_report(report, report_images).encode('utf-8'))
+        else:
+            raise ValueError(f"Unsupported report format: {fmt}")
+    return outputs
+
+
+def build_report(report, fmt='pdf', interactive=False, cache=None, max_workers=REPORT_WORKERS):
+    """
+    Build a single report, see build_reports
+    """
+    return build_reports([report], fmt, interactive, cache, max_workers)[0]
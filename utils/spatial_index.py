@@ -0,0 +1,186 @@
+import itertools
+import threading
+
+from shapely.geometry import box, mapping, shape
+from shapely.geometry.base import BaseGeometry
+from shapely.prepared import prep
+
+from utils.lazy import lazy_import
+
+index = lazy_import('rtree.index')
+
+# Layers kept in the index. Each layer gets its own R-tree so a lookup for
+# reaches never has to wade through thousands of tile footprints.
+REACHES = 'reaches'
+TILES = 'tiles'
+RESULTS = 'results'
+LAYERS = (REACHES, TILES, RESULTS)
+
+
+def as_geometry(geometry):
+    """
+    Coerce a shapely geometry, GeoJSON mapping/Feature or bounds tuple to a shapely geometry
+    """
+    if isinstance(geometry, BaseGeometry):
+        return geometry
+    if isinstance(geometry, (tuple, list)) and len(geometry) == 4:
+        return box(*geometry)
+    if isinstance(geometry, dict):
+        if geometry.get('type') == 'Feature':
+            geometry = geometry['geometry']
+        return shape(geometry)
+    raise TypeError(f"Unsupported geometry type: {type(geometry).__name__}")
+
+
+class SpatialIndex:
+    """
+    R-tree backed index of reach geometries, cached tile footprints and stored
+    result extents, used to resolve a user AOI to previously analyzed work
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids = itertools.count()
+        self._trees = {layer: index.Index() for layer in LAYERS}
+        # layer -> rtree id -> (key, geometry, payload)
+        self._entries = {layer: {} for layer in LAYERS}
+        # layer -> key -> rtree id
+        self._keys = {layer: {} for layer in LAYERS}
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def insert(self, layer, key, geometry, payload=None):
+        """
+        Add (or replace) an item in a layer
+        """
+        self._check_layer(layer)
+        geometry = as_geometry(geometry)
+        with self._lock:
+            if key in self._keys[layer]:
+                self.remove(layer, key)
+            item_id = next(self._ids)
+            self._trees[layer].insert(item_id, geometry.bounds)
+            self._entries[layer][item_id] = (key, geometry, payload)
+            self._keys[layer][key] = item_id
+        return item_id
+
+    def bulk_load(self, layer, items):
+        """
+        Replace a layer with (key, geometry, payload) items using R-tree bulk loading
+
+        As with insert, a repeated key replaces the earlier item.
+        """
+        self._check_layer(layer)
+        entries = {}
+        keys = {}
+        for key, geometry, payload in items:
+            geometry = as_geometry(geometry)
+            if key in keys:
+                del entries[keys[key]]
+            item_id = next(self._ids)
+            entries[item_id] = (key, geometry, payload)
+            keys[key] = item_id
+
+        def stream():
+            for item_id, (_, geometry, _) in entries.items():
+                yield item_id, geometry.bounds, None
+
+        # Stream loading builds a packed tree, which is much faster to build and
+        # query than inserting items one at a time
+        tree = index.Index(stream()) if entries else index.Index()
+        with self._lock:
+            self._trees[layer] = tree
+            self._entries[layer] = entries
+            self._keys[layer] = keys
+
+    def remove(self, layer, key):
+        """
+        Remove an item from a layer, returning True if it was present
+        """
+        self._check_layer(layer)
+        with self._lock:
+            item_id = self._keys[layer].pop(key, None)
+            if item_id is None:
+                return False
+            _, geometry, _ = self._entries[layer].pop(item_id)
+            self._trees[layer].delete(item_id, geometry.bounds)
+        return True
+
+    def add_reach(self, reach_id, geometry, **attributes):
+        """
+        Register a river reach geometry
+        """
+        return self.insert(REACHES, reach_id, geometry, attributes)
+
+    def add_tile(self, tile_key, footprint, **attributes):
+        """
+        Register the footprint of a cached imagery or prediction tile
+        """
+        return self.insert(TILES, tile_key, footprint, attributes)
+
+    def add_result(self, result_id, extent, **attributes):
+        """
+        Register the extent of a stored analysis result
+        """
+        return self.insert(RESULTS, result_id, extent, attributes)
+
+    def query(self, geometry, layers=LAYERS, exact=True):
+        """
+        Find items overlapping a geometry
+
+        `layers` is a layer name or a sequence of them. Returns a dict of
+        layer -> list of (key, geometry, payload). The R-tree narrows
+        candidates by bounding box; with exact=True the candidates are then
+        tested against the true geometry with a prepared predicate.
+        """
+        if isinstance(layers, str):
+            layers = (layers,)
+        geometry = as_geometry(geometry)
+        bounds = geometry.bounds
+        prepared = prep(geometry) if exact else None
+
+        hits = {}
+        with self._lock:
+            for layer in layers:
+                self._check_layer(layer)
+                entries = self._entries[layer]
+                matches = []
+                for item_id in self._trees[layer].intersection(bounds):
+                    entry = entries[item_id]
+                    if prepared is None or prepared.intersects(entry[1]):
+                        matches.append(entry)
+                hits[layer] = matches
+        return hits
+
+    def nearest(self, geometry, layer=REACHES, count=1):
+        """
+        Return the items in a layer whose bounding boxes are closest to a geometry
+        """
+        self._check_layer(layer)
+        bounds = as_geometry(geometry).bounds
+        with self._lock:
+            entries = self._entries[layer]
+            return [entries[item_id] for item_id in self._trees[layer].nearest(bounds, count)]
+
+    def to_geojson(self, layer):
+        """
+        Export a layer as a GeoJSON FeatureCollection
+        """
+        self._check_layer(layer)
+        with self._lock:
+            features = [
+                {
+                    "type": "Feature",
+                    "id": key,
+                    "geometry": mapping(geometry),
+                    "properties": dict(payload or {})
+                }
+                for key, geometry, payload in self._entries[layer].values()
+            ]
+        return {"type": "FeatureCollection", "features": features}
+
+    @staticmethod
+    def _check_layer(layer):
+        if layer not in LAYERS:
+            raise ValueError(f"Unknown layer '{layer}', expected one of {LAYERS}")
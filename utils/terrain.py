@@ -0,0 +1,337 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from utils.instrumentation import instrument
+from utils.lazy import lazy_import
+
+rasterio = lazy_import('rasterio')
+warp = lazy_import('rasterio.warp')
+
+# SRTM void marker
+SRTM_NODATA = -32768
+
+# Ground resolution of a Web Mercator tile pixel at zoom 0, in metres at the equator
+ZOOM0_METERS_PER_PIXEL = 156543.03392
+
+# Length of one degree of latitude, in metres
+METERS_PER_DEGREE = 111320.0
+
+# SRTM tiles are named after their south-west corner, e.g. N45E007.hgt
+HGT_NAME = re.compile(r'^([NS])(\d{2})([EW])(\d{3})', re.IGNORECASE)
+
+# Grid spacing (m) assumed for DEMs without georeferencing (.npy)
+DEFAULT_PIXEL_SIZE = 30.0
+
+# Triangle budget for meshes sent to the browser
+MAX_TRIANGLES = 200000
+
+# Times build_mesh may double its tolerance to meet the triangle budget; from
+# any positive tolerance this exceeds every real elevation range
+MAX_TOLERANCE_DOUBLINGS = 64
+
+
+def hgt_latitude(name):
+    """
+    Centre latitude of an SRTM tile from its file name, or None if the name is not standard
+    """
+    match = HGT_NAME.match(os.path.basename(name))
+    if match is None:
+        return None
+    south = int(match.group(2)) * (-1 if match.group(1).upper() == 'S' else 1)
+    return south + 0.5
+
+
+def degree_spacing(row_degrees, col_degrees, latitude):
+    """
+    Ground size (m) of a (row, col) grid step given in degrees at a latitude
+    """
+    return (row_degrees * METERS_PER_DEGREE,
+            col_degrees * METERS_PER_DEGREE * np.cos(np.radians(latitude)))
+
+
+def load_dem(path, name=None):
+    """
+    Load a local DEM tile as a float32 array with NaN for voids
+
+    Supports raw SRTM .hgt tiles (big-endian int16, 1201 or 3601 square),
+    .npy arrays and GeoTIFFs (via rasterio). Returns (dem, pixel_size,
+    latitude): the (row, col) grid spacing in metres and the latitude of the
+    tile centre. .hgt tiles take both from their size and file name (`name`
+    when the file is a renamed copy); GeoTIFFs from their transform and CRS.
+    Without georeferencing DEFAULT_PIXEL_SIZE and the equator are assumed.
+    """
+    name = name or path
+    ext = os.path.splitext(path)[1].lower()
+    pixel_size = (DEFAULT_PIXEL_SIZE, DEFAULT_PIXEL_SIZE)
+    latitude = 0.0
+    if ext == '.hgt':
+        data = np.fromfile(path, dtype='>i2')
+        side = int(round(np.sqrt(data.size)))
+        if side * side != data.size:
+            raise ValueError(f"{os.path.basename(name)} is not a square SRTM tile")
+        dem = data.reshape(side, side).astype(np.float32)
+        dem[data.reshape(side, side) == SRTM_NODATA] = np.nan
+        # Tiles span one degree with shared edges: 1201 samples are 3", 3601 are 1"
+        latitude = hgt_latitude(name)
+        if latitude is None:
+            latitude = 0.0
+        pixel_size = degree_spacing(1.0 / (side - 1), 1.0 / (side - 1), latitude)
+    elif ext == '.npy':
+        dem = np.load(path).astype(np.float32)
+    elif ext in ('.tif', '.tiff'):
+        with rasterio.open(path) as src:
+            dem = src.read(1, masked=True).astype(np.float32).filled(np.nan)
+            x, y = src.transform * (src.width / 2, src.height / 2)
+            col_step, row_step = src.res
+            if src.crs is None:
+                pixel_size = (row_step, col_step)
+            elif src.crs.is_geographic:
+                latitude = y
+                pixel_size = degree_spacing(row_step, col_step, latitude)
+            else:
+                # Projected CRS in metres
+                latitude = warp.transform(src.crs, 'EPSG:4326', [x], [y])[1][0]
+                pixel_size = (row_step, col_step)
+    else:
+        raise ValueError(f"Unsupported DEM format: {ext}")
+    return dem, tuple(float(step) for step in pixel_size), float(latitude)
+
+
+def fill_voids(dem):
+    """
+    Replace NaN (or infinite) voids with the mean elevation so the mesh stays closed
+    """
+    valid = np.isfinite(dem)
+    if not valid.all():
+        if not valid.any():
+            raise ValueError("DEM has no valid elevation samples")
+        dem = np.where(valid, dem, dem[valid].mean()).astype(np.float32)
+    return dem
+
+
+def dem_key(dem):
+    """
+    Content hash of a DEM array, used as its cache key
+    """
+    dem = np.ascontiguousarray(dem)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{dem.shape}{dem.dtype.str}".encode())
+    digest.update(dem.data)
+    return digest.hexdigest()
+
+
+def zoom_tolerance(zoom, latitude=0.0, pixel_error=0.5, vertical_exaggeration=1.0):
+    """
+    Vertical error (m) below what is visible at a map zoom level: a fraction
+    of the ground size of one screen pixel
+
+    Exaggerated relief magnifies the error on screen by the same factor, so
+    the tolerance shrinks with it.
+    """
+    ground = pixel_error * ZOOM0_METERS_PER_PIXEL * np.cos(np.radians(latitude)) / 2 ** zoom
+    return ground / vertical_exaggeration
+
+
+def _pad_to_power_of_two(dem):
+    height, width = dem.shape
+    size = 1 << int(np.ceil(np.log2(max(height, width, 2) - 1)))
+    padded = np.pad(dem, ((0, size + 1 - height), (0, size + 1 - width)), mode='edge')
+    return padded, size
+
+
+def error_pyramid(dem, min_block=1):
+    """
+    Maximum vertical error of approximating every quadtree block by bilinear
+    interpolation of its four corners, for every block size
+
+    Returns (size, {block_size: (n, n) errors}), size being the padded
+    power-of-two extent. Each level is computed in one vectorized pass.
+    """
+    padded, size = _pad_to_power_of_two(dem)
+    levels = {}
+    block = size
+    while block > min_block:
+        n = size // block
+        index = np.arange(size + 1)
+        cell = np.minimum(index // block, n - 1)
+        frac = ((index - cell * block) / block).astype(np.float32)
+        corners = padded[::block, ::block]
+
+        # Separable bilinear interpolation: along rows on the coarse columns, then along columns
+        rows = (1 - frac[:, None]) * corners[cell] + frac[:, None] * corners[cell + 1]
+        error = (1 - frac) * rows[:, cell]
+        error += frac * rows[:, cell + 1]
+        error -= padded
+        np.abs(error, out=error)
+
+        blocks = error[:size, :size].reshape(n, block, n, block).max(axis=3).max(axis=1)
+        # The last row and column of the grid belong to the last row/column of blocks
+        blocks[-1, :] = np.maximum(blocks[-1, :], error[size, :size].reshape(n, block).max(axis=1))
+        blocks[:, -1] = np.maximum(blocks[:, -1], error[:size, size].reshape(n, block).max(axis=1))
+        blocks[-1, -1] = max(blocks[-1, -1], error[size, size])
+        levels[block] = blocks
+        block //= 2
+    return size, levels
+
+
+def select_blocks(levels, size, tolerance, min_block=1):
+    """
+    Top-down quadtree selection: keep a block when its error is within tolerance,
+    otherwise split it into four. Returns (rows, cols, sizes) of the leaf blocks.
+    """
+    rows, cols, sizes = [], [], []
+    split = np.ones((1, 1), dtype=bool)
+    block = size
+    while block >= min_block and split.any():
+        errors = levels.get(block)
+        accept = split if errors is None else split & (errors <= tolerance)
+        if block == min_block:
+            accept = split
+        r, c = np.nonzero(accept)
+        rows.append(r * block)
+        cols.append(c * block)
+        sizes.append(np.full(r.size, block))
+        split = (split & ~accept).repeat(2, axis=0).repeat(2, axis=1)
+        block //= 2
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(sizes)
+
+
+@instrument(category='render')
+def build_mesh(dem, pixel_size=30.0, tolerance=1.0, max_triangles=MAX_TRIANGLES, min_block=1, pyramid=None):
+    """
+    Error-bounded quadtree triangle mesh of a DEM
+
+    Blocks are merged while bilinear interpolation of their corners stays
+    within `tolerance` metres (> 0) of every covered DEM sample; the tolerance
+    is doubled until the mesh fits in max_triangles. Neighbouring blocks of
+    different sizes can leave T-junction slits no taller than the tolerance.
+    pixel_size is the grid spacing in metres, a scalar or a (row, col) pair.
+    Returns a dict with vertices (x, y, z), triangle indices (i, j, k), the
+    grid row/col of every vertex and the tolerance actually used. A
+    precomputed error_pyramid can be passed to skip the per-DEM work.
+    """
+    if not tolerance > 0:
+        raise ValueError(f"tolerance must be positive, got {tolerance}")
+    dem = fill_voids(np.asarray(dem, dtype=np.float32))
+    height, width = dem.shape
+    size, levels = pyramid or error_pyramid(dem, min_block)
+
+    for _ in range(MAX_TOLERANCE_DOUBLINGS):
+        r, c, s = select_blocks(levels, size, tolerance, min_block)
+        inside = (r < height) & (c < width)
+        r, c, s = r[inside], c[inside], s[inside]
+        if 2 * r.size <= max_triangles or s.min() == size:
+            break
+        tolerance *= 2
+    else:
+        raise ValueError(f"Could not fit the DEM mesh in {max_triangles} triangles")
+
+    # Corners of every block, clamped onto the real grid
+    corner_rows = np.minimum(np.stack([r, r, r + s, r + s], axis=1), height - 1)
+    corner_cols = np.minimum(np.stack([c, c + s, c, c + s], axis=1), width - 1)
+    flat = corner_rows * width + corner_cols
+    unique, inverse = np.unique(flat, return_inverse=True)
+    inverse = inverse.reshape(flat.shape)
+
+    # Two triangles per block: (top-left, top-right, bottom-left) and (top-right, bottom-right, bottom-left)
+    triangles = np.concatenate([inverse[:, [0, 1, 2]], inverse[:, [1, 3, 2]]])
+    degenerate = ((triangles[:, 0] == triangles[:, 1]) | (triangles[:, 1] == triangles[:, 2])
+                  | (triangles[:, 0] == triangles[:, 2]))
+    triangles = triangles[~degenerate]
+
+    vertex_rows, vertex_cols = np.divmod(unique, width)
+    row_step, col_step = np.broadcast_to(np.asarray(pixel_size, dtype=np.float64), (2,))
+    return {
+        'x': vertex_cols * col_step,
+        'y': (height - 1 - vertex_rows) * row_step,
+        'z': dem[vertex_rows, vertex_cols],
+        'i': triangles[:, 0],
+        'j': triangles[:, 1],
+        'k': triangles[:, 2],
+        'rows': vertex_rows,
+        'cols': vertex_cols,
+        'tolerance': tolerance,
+    }
+
+
+def drape(mesh, layer):
+    """
+    Sample a raster on the DEM grid (river mask, erosion map) at the mesh vertices
+    """
+    layer = np.asarray(layer)
+    return layer[mesh['rows'], mesh['cols']]
+
+
+def surface_grid(dem, max_cells=250000):
+    """
+    Block-averaged DEM with at most max_cells samples, for Plotly Surface plots
+    """
+    dem = fill_voids(np.asarray(dem, dtype=np.float32))
+    height, width = dem.shape
+    factor = max(1, int(np.ceil(np.sqrt(height * width / max_cells))))
+    if factor == 1:
+        return dem, 1
+    h, w = height // factor * factor, width // factor * factor
+    return dem[:h, :w].reshape(h // factor, factor, w // factor, factor).mean(axis=(1, 3)), factor
+
+
+class TerrainMeshCache:
+    """
+    LRU cache of terrain meshes keyed by DEM content, zoom level, latitude
+    and vertical exaggeration
+
+    The error pyramid of the most recent DEMs is kept as well, so moving to
+    another zoom level only reruns the cheap block selection.
+    """
+
+    def __init__(self, max_entries=16, max_pyramids=2):
+        self.max_entries = max_entries
+        self.max_pyramids = max_pyramids
+        self._meshes = OrderedDict()
+        self._pyramids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pyramid(self, key, dem):
+        with self._lock:
+            pyramid = self._pyramids.get(key)
+            if pyramid is not None:
+                self._pyramids.move_to_end(key)
+                return pyramid
+        pyramid = error_pyramid(fill_voids(np.asarray(dem, dtype=np.float32)))
+        with self._lock:
+            self._pyramids[key] = pyramid
+            while len(self._pyramids) > self.max_pyramids:
+                self._pyramids.popitem(last=False)
+        return pyramid
+
+    def get(self, dem, zoom, latitude=0.0, pixel_size=DEFAULT_PIXEL_SIZE, vertical_exaggeration=1.0,
+            max_triangles=MAX_TRIANGLES, key=None):
+        """
+        Return the mesh for a DEM at a zoom level, building it on a miss
+        """
+        key = key or dem_key(dem)
+        # Latitude and exaggeration scale the zoom tolerance, so they are part of the key
+        spacing = tuple(np.broadcast_to(np.asarray(pixel_size, dtype=np.float64), (2,)).tolist())
+        cache_key = (key, int(zoom), float(latitude), spacing, float(vertical_exaggeration), int(max_triangles))
+        with self._lock:
+            mesh = self._meshes.get(cache_key)
+            if mesh is not None:
+                self._meshes.move_to_end(cache_key)
+                return mesh
+
+        mesh = build_mesh(
+            dem,
+            pixel_size=spacing,
+            tolerance=zoom_tolerance(zoom, latitude, vertical_exaggeration=vertical_exaggeration),
+            max_triangles=max_triangles,
+            pyramid=self._pyramid(key, dem)
+        )
+        with self._lock:
+            self._meshes[cache_key] = mesh
+            while len(self._meshes) > self.max_entries:
+                self._meshes.popitem(last=False)
+        return mesh
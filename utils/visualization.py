@@ -1,10 +1,13 @@
-import folium
-import plotly.express as px
-import plotly.graph_objects as go
 import numpy as np
-import pandas as pd
-from datetime import datetime
+from utils.instrumentation import instrument
+from utils.lazy import lazy_import
 
+# Imported on first use to keep app cold start fast
+cv2 = lazy_import('cv2')
+folium = lazy_import('folium')
+go = lazy_import('plotly.graph_objects')
+
+@instrument(category='render')
 def create_folium_map(center_lat=20, center_lon=78, zoom_start=5):
     """
     Create a base Folium map
@@ -16,6 +19,7 @@ def create_folium_map(center_lat=20, center_lon=78, zoom_start=5):
     )
     return m
 
+@instrument(category='render')
 def add_river_layer(map_obj, river_mask, name='River Channel'):
     """
     Add river channel layer to Folium map
@@ -58,6 +62,7 @@ def add_river_layer(map_obj, river_mask, name='River Channel'):
     
     return map_obj
 
+@instrument(category='render')
 def plot_time_series(data, title='River Morphology Time Series'):
     """
     Create interactive time series plot
@@ -86,6 +91,7 @@ def plot_time_series(data, title='River Morphology Time Series'):
     
     return fig
 
+@instrument(category='render')
 def plot_morphological_metrics(metrics):
     """
     Create bar plot of morphological metrics
@@ -111,6 +117,7 @@ def plot_morphological_metrics(metrics):
     
     return fig
 
+@instrument(category='render')
 def plot_erosion_deposition(erosion_area, deposition_area):
     """
     Create pie chart of erosion and deposition areas
@@ -126,4 +133,42 @@ def plot_erosion_deposition(erosion_area, deposition_area):
         annotations=[dict(text='Area', x=0.5, y=0.5, font_size=20, showarrow=False)]
     )
     
-    return fig 
\ No newline at end of file
+    return fig 
+
+@instrument(category='render')
+def plot_terrain_mesh(mesh, intensity=None, colorscale='Earth', intensity_name='Elevation (m)',
+                      vertical_exaggeration=1.0, title='Terrain'):
+    """
+    Create a 3D terrain plot from a decimated mesh (see utils.terrain.build_mesh)
+
+    Draped layers (river mask, erosion map) are passed as per-vertex intensity;
+    elevation is used otherwise.
+    """
+    z = np.asarray(mesh['z'])
+    fig = go.Figure(data=[go.Mesh3d(
+        x=mesh['x'],
+        y=mesh['y'],
+        z=z * vertical_exaggeration,
+        i=mesh['i'],
+        j=mesh['j'],
+        k=mesh['k'],
+        intensity=z if intensity is None else intensity,
+        colorscale=colorscale,
+        colorbar=dict(title=intensity_name),
+        flatshading=False,
+        lighting=dict(ambient=0.5, diffuse=0.8, specular=0.1, roughness=0.9),
+        hoverinfo='skip'
+    )])
+    
+    fig.update_layout(
+        title=title,
+        scene=dict(
+            xaxis_title='Easting (m)',
+            yaxis_title='Northing (m)',
+            zaxis_title='Elevation (m)',
+            aspectmode='data'
+        ),
+        margin=dict(l=0, r=0, t=40, b=0)
+    )
+    
+    return fig